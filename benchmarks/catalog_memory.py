@@ -0,0 +1,103 @@
+import sys
+import json
+import time
+import pathlib
+import tempfile
+import warnings
+
+import argparse
+import numpy as np
+import pandas as pd
+
+from utils.utils import load_results
+from utils.storage import get_backend
+from utils.track_index import track_index
+from utils.catalog import track_catalog
+from benchmarks.clusterization import generate_inputs
+
+
+def parse_args():
+    """
+    Parse arguments passed when calling the scripts
+
+    Returns a dict with all the arguments
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--unique_tracks', default=200000, type=int,
+                        help='Number of distinct tracks. Default is 200000')
+    parser.add_argument('--workdir', default=None, type=str,
+                        help='Folder where the synthetic data is generated. If it already has data, it is reused. Default is a temporary folder')
+    parser.add_argument('-o', '--output', default='catalog_memory_benchmark.json', type=str,
+                        help='Json file where the report is saved. Default is catalog_memory_benchmark.json')
+    return vars(parser.parse_args())
+
+
+def dataframes_memory(filepath: str) -> dict:
+    """
+    Returns:
+        dict with the bytes used by the track index and song features dataframes, as the scripts load them
+    """
+    tracks = track_index(filepath=filepath).load()
+    features = load_results(filename='spotify_songs_features', filepath=filepath)
+    return {'tracks': int(tracks.memory_usage(deep=True).sum()),
+            'features': int(features.memory_usage(deep=True).sum())}
+
+
+def catalog_memory(filepath: str) -> dict:
+    """
+    Returns:
+        dict with the bytes used by the tracks and the song features of the catalog
+    """
+    catalog = track_catalog.load(filepath=filepath)
+    features = catalog.feature_ids.nbytes + catalog.features.nbytes + catalog.int_features.nbytes
+    return {'tracks': int(catalog.memory_usage() - features), 'features': int(features)}
+
+
+if __name__ == "__main__":
+
+    warnings.filterwarnings("ignore")
+    args = parse_args()
+
+    temporary = None
+    if args['workdir'] is None:
+        temporary = tempfile.TemporaryDirectory()
+        filepath = temporary.name
+    else:
+        filepath = args['workdir']
+        pathlib.Path(filepath).mkdir(parents=True, exist_ok=True)
+
+    try:
+        if not get_backend().exists(filename='spotify_songs_features', filepath=filepath):
+            print(f"Generating {args['unique_tracks']} tracks on {filepath}")
+            # Only the tracks and features are measured, a single scrobble per track is enough
+            generate_inputs(filepath=filepath,
+                            scrobbles=args['unique_tracks'],
+                            unique_tracks=args['unique_tracks'])
+
+        start = time.perf_counter()
+        dataframes = dataframes_memory(filepath=filepath)
+        dataframes_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        catalog = catalog_memory(filepath=filepath)
+        catalog_seconds = time.perf_counter() - start
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    print(f"{'data':<10} {'dataframes':>14} {'catalog':>14} {'ratio':>8}")
+    report = {'unique_tracks': args['unique_tracks'],
+              'python': sys.version.split()[0],
+              'pandas': pd.__version__,
+              'numpy': np.__version__,
+              'load_seconds': {'dataframes': round(dataframes_seconds, 4), 'catalog': round(catalog_seconds, 4)},
+              'memory_mb': {}}
+    for data in ['tracks', 'features']:
+        report['memory_mb'][data] = {'dataframes': round(dataframes[data] / 1024 ** 2, 1),
+                                     'catalog': round(catalog[data] / 1024 ** 2, 1)}
+        print(f"{data:<10} {dataframes[data] / 1024 ** 2:>11.1f} MB {catalog[data] / 1024 ** 2:>11.1f} MB "
+              f"{dataframes[data] / max(catalog[data], 1):>7.1f}x")
+
+    with open(args['output'], 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved on {args['output']}")
@@ -0,0 +1,200 @@
+import sys
+import json
+import time
+import pathlib
+import tempfile
+import warnings
+import tracemalloc
+
+import argparse
+import numpy as np
+import pandas as pd
+
+from utils.utils import save_results, user_partitions_path
+from utils.scrobble_store import upsert_scrobbles
+from utils.track_index import track_index
+from utils.storage import FEATURES_DTYPES
+from utils.spotify_api import FEATURES_COLUMNS
+from scripts.clusterization import load_data, join_data, dedupe_data, scale_features, fit_clusters, save_clusters
+
+
+USER = 'benchmark_user'
+
+
+def parse_args():
+    """
+    Parse arguments passed when calling the scripts
+
+    Returns a dict with all the arguments
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--scrobbles', default=1000000, type=int,
+                        help='Number of synthetic scrobbles. Default is 1000000')
+    parser.add_argument('-u', '--unique_tracks', default=200000, type=int,
+                        help='Number of distinct tracks. Default is 200000')
+    parser.add_argument('-k', '--clusters', default=8, type=int,
+                        help='Number of clusters. Default is 8')
+    parser.add_argument('-a', '--algorithm', default='auto', type=str,
+                        help='Algorithm for the KMeans clusterization. Default is auto')
+    parser.add_argument('-w', '--weighted', action='store_true',
+                        help='If declared, the play counts are used as sample weights on the fit')
+    parser.add_argument('--no_memory', action='store_true',
+                        help='If declared, the memory is not traced (tracing slows down the python heavy steps)')
+    parser.add_argument('--workdir', default=None, type=str,
+                        help='Folder where the synthetic data is generated. If it already has data, it is reused. Default is a temporary folder')
+    parser.add_argument('-o', '--output', default='clusterization_benchmark.json', type=str,
+                        help='Json file where the report is saved. Default is clusterization_benchmark.json')
+    return vars(parser.parse_args())
+
+
+def generate_inputs(filepath: str, scrobbles: int, unique_tracks: int, seed: int = 1) -> None:
+    """
+    Description:
+        Generate the clusterization input files: the user played tracks partitions, the song features dataset
+            and the track ids index
+        Plays are skewed (a few tracks are played many times) and one out of 20 tracks has no spotify id
+
+    Arguments:
+        filepath(string):
+            The data folder
+
+        scrobbles(int):
+            Number of scrobbles
+
+        unique_tracks(int):
+            Number of distinct (artist, song)
+
+        seed(int) = 1:
+            Seed of the synthetic data
+
+    Returns:
+        None
+    """
+    rng = np.random.default_rng(seed)
+    numbers = np.arange(unique_tracks)
+    artists = max(1, unique_tracks // 8)
+
+    tracks = pd.DataFrame({'artist': [f'Artist {number % artists}' for number in numbers],
+                           'song': [f'Song {number}' for number in numbers],
+                           'sp_id': [f'{number:022x}' for number in numbers],
+                           'no_id': numbers % 20 == 0})
+    tracks.loc[tracks['no_id'], 'sp_id'] = 'not_found'
+    track_index(filepath=filepath).upsert(tracks)
+
+    found = tracks.loc[~tracks['no_id'], 'sp_id'].reset_index(drop=True)
+    features = pd.DataFrame({'id': found})
+    for feature, dtype in FEATURES_DTYPES.items():
+        if np.issubdtype(dtype, np.floating):
+            features[feature] = rng.random(len(found), dtype=np.float32)
+        else:
+            features[feature] = rng.integers(0, 12, len(found)).astype(dtype)
+    features['loudness'] = features['loudness'] * -30
+    features['tempo'] = features['tempo'] * 120 + 60
+    features['duration_ms'] = rng.integers(90000, 480000, len(found))
+    features['type'] = 'audio_features'
+    features['uri'] = 'spotify:track:' + features['id']
+    features['track_href'] = 'https://api.spotify.com/v1/tracks/' + features['id']
+    features['analysis_url'] = 'https://api.spotify.com/v1/audio-analysis/' + features['id']
+    save_results(filename='spotify_songs_features', df=features[FEATURES_COLUMNS], filepath=filepath)
+
+    played = (unique_tracks * rng.random(scrobbles) ** 2).astype(np.int64)
+    played = pd.DataFrame({'artist': tracks['artist'].values[played],
+                           'song': tracks['song'].values[played],
+                           'unix_timestamp': 1577836800 + np.arange(scrobbles, dtype=np.int64) * 60,
+                           'nowplaying': False})
+    upsert_scrobbles(df=played, filepath=user_partitions_path(filename='lastfm_played_tracks',
+                                                              user=USER, filepath=filepath))
+
+
+def profile(step: str, func, trace_memory: bool = True, **kwargs):
+    """
+    Description:
+        Run a step, measuring its wall time and (if trace_memory) the peak memory allocated while it runs
+
+    Returns:
+        tuple with the step result and a dict with the step measures
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func(**kwargs)
+    elapsed = time.perf_counter() - start
+
+    measures = {'step': step, 'seconds': round(elapsed, 4)}
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        measures['peak_memory_mb'] = round(peak / 1024 ** 2, 1)
+
+    rows = result[0] if isinstance(result, tuple) else result
+    if hasattr(rows, 'shape'):
+        measures['output_rows'] = int(rows.shape[0])
+
+    print(f"{step:<8} {measures['seconds']:>10.3f}s "
+          f"{measures.get('peak_memory_mb', float('nan')):>10.1f} MB {measures.get('output_rows', ''):>10}")
+    return result, measures
+
+
+if __name__ == "__main__":
+
+    warnings.filterwarnings("ignore")
+    args = parse_args()
+
+    temporary = None
+    if args['workdir'] is None:
+        temporary = tempfile.TemporaryDirectory()
+        filepath = temporary.name
+    else:
+        filepath = args['workdir']
+        pathlib.Path(filepath).mkdir(parents=True, exist_ok=True)
+
+    try:
+        if not (pathlib.Path(filepath) / 'users' / USER).is_dir():
+            print(f"Generating {args['scrobbles']} scrobbles of {args['unique_tracks']} tracks on {filepath}")
+            start = time.perf_counter()
+            generate_inputs(filepath=filepath,
+                            scrobbles=args['scrobbles'],
+                            unique_tracks=args['unique_tracks'])
+            print(f"Synthetic data generated in {time.perf_counter() - start:.1f}s")
+
+        trace_memory = not args['no_memory']
+        print(f"{'step':<8} {'time':>11} {'peak memory':>13} {'rows':>10}")
+
+        steps = []
+        (played, catalog, ids), measures = profile('load', load_data, trace_memory,
+                                                   user=USER, filepath=filepath)
+        steps.append(measures)
+        df, measures = profile('join', join_data, trace_memory,
+                               played=played, catalog=catalog, ids=ids)
+        steps.append(measures)
+        del played
+        df, measures = profile('dedupe', dedupe_data, trace_memory, df=df)
+        steps.append(measures)
+        (X, _), measures = profile('scale', scale_features, trace_memory, df=df)
+        steps.append(measures)
+        kmeans, measures = profile('fit', fit_clusters, trace_memory, X=X,
+                                   clusters=args['clusters'], algorithm=args['algorithm'],
+                                   sample_weight=df['play_count'].values if args['weighted'] else None)
+        steps.append(measures)
+        _, measures = profile('save', save_clusters, trace_memory, df=df,
+                              labels=kmeans.labels_, user=USER, filepath=filepath)
+        steps.append(measures)
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    report = {'scrobbles': args['scrobbles'],
+              'unique_tracks': args['unique_tracks'],
+              'clusters': args['clusters'],
+              'algorithm': args['algorithm'],
+              'weighted': args['weighted'],
+              'python': sys.version.split()[0],
+              'pandas': pd.__version__,
+              'numpy': np.__version__,
+              'total_seconds': round(sum(step['seconds'] for step in steps), 4),
+              'steps': steps}
+
+    with open(args['output'], 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved on {args['output']}")
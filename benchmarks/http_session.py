@@ -0,0 +1,69 @@
+import json
+import time
+
+import argparse
+import requests as re
+
+from utils.http_client import http_client
+from utils.concurrency import fetch_ordered
+from benchmarks.stand_in_server import stand_in_server
+
+
+def parse_args():
+    """
+    Parse arguments passed when calling the scripts
+
+    Returns a dict with all the arguments
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--requests', default=2000, type=int,
+                        help='Number of requests per scenario. Default is 2000')
+    parser.add_argument('-w', '--workers', default=8, type=int,
+                        help='Number of concurrent workers on the concurrent scenarios. Default is 8')
+    parser.add_argument('--latency', default=0, type=float,
+                        help='Seconds added by the stand-in server to every response. Default is 0')
+    parser.add_argument('-o', '--output', default=None, type=str,
+                        help='If declared, the results are also saved on this json file')
+    return vars(parser.parse_args())
+
+
+def run(get, url: str, requests: int, workers: int) -> float:
+    """
+    Make the requests (sequentially if workers is 1) and return the requests per second
+    """
+
+    start = time.perf_counter()
+    if workers == 1:
+        for _ in range(requests):
+            get(url).raise_for_status()
+    else:
+        for r in fetch_ordered(func=lambda _: get(url), items=range(requests), workers=workers):
+            r.raise_for_status()
+    return requests / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    server = stand_in_server(latency=args['latency']).start()
+    url = server.url + '/ping'
+
+    client = http_client(pool_size=args['workers'])
+
+    # before: module-level requests.get (a new connection per request)
+    # after: the pooled keep-alive client
+    results = []
+    for workers in [1, args['workers']]:
+        for name, get in [('requests.get', re.get), ('http_client', client.get)]:
+            rate = run(get=get, url=url,
+                       requests=args['requests'], workers=workers)
+            results.append({'client': name, 'workers': workers,
+                            'requests': args['requests'], 'requests_per_second': round(rate, 1)})
+            print(f"{name:<14} workers={workers:<3} {rate:10.1f} requests/s")
+
+    server.stop()
+
+    if args['output'] is not None:
+        with open(args['output'], 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import pathlib
+import tempfile
+import subprocess
+
+import argparse
+
+from utils.credentials import credential_cache
+from benchmarks.stand_in_server import stand_in_server
+from benchmarks.stand_in_apis import stand_in_apis, environment
+
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+USER = 'stand_in_user'
+CLIENT_ID = 'stand-in-client-id'
+# Scope requested by create_playlists, so the seeded refresh token is accepted and no browser is opened
+PLAYLISTS_SCOPE = 'playlist-modify-public user-read-private'
+
+
+def parse_args():
+    """
+    Parse arguments passed when calling the scripts
+
+    Returns a dict with all the arguments
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', default='1000,10000,50000', type=str,
+                        help='Comma separated numbers of scrobbles to run the pipeline with. Default is 1000,10000,50000')
+    parser.add_argument('-u', '--unique_ratio', default=0.2, type=float,
+                        help='Distinct tracks per scrobble. Default is 0.2')
+    parser.add_argument('-k', '--clusters', default=4, type=int,
+                        help='Number of clusters (and playlists). Default is 4')
+    parser.add_argument('-a', '--algorithm', default='auto', type=str,
+                        help='Algorithm of the KMeans clusterization stage. Default is auto')
+    parser.add_argument('-l', '--lenght', default=20, type=int,
+                        help='Number of songs per playlist. Default is 20')
+    parser.add_argument('-w', '--workers', default=8, type=int,
+                        help='Number of concurrent workers of the extraction stages. Default is 8')
+    parser.add_argument('--latency', default=0, type=float,
+                        help='Seconds added by the stand-in server to every response. Default is 0')
+    parser.add_argument('--rate_limit_every', default=0, type=int,
+                        help='If declared, every nth request is answered with a 429 status (spotify api only)')
+    parser.add_argument('--workdir', default=None, type=str,
+                        help='Folder where the data of each run is kept. Default is a temporary folder, removed at the end')
+    parser.add_argument('-o', '--output', default=None, type=str,
+                        help='If declared, the results are also saved on this json file')
+    return vars(parser.parse_args())
+
+
+def stages(args: dict) -> list:
+    """
+    Returns:
+        list with the (stage name, script arguments) of the pipeline, in the order they run
+    """
+    return [
+        ('lastfm_extraction', ['20200101', '--concurrent', f"--workers={args['workers']}", '--rate=1000']),
+        ('spotify_extraction', [f"--workers={args['workers']}", '--rate=1000']),
+        ('clusterization', [str(args['clusters']), f"--algorithm={args['algorithm']}"]),
+        ('create_playlists', [f"--lenght={args['lenght']}", f"--workers={args['workers']}", '--rate=1000']),
+    ]
+
+
+def run_stage(name: str, arguments: list, workdir: pathlib.Path, env: dict) -> dict:
+    """
+    Description:
+        Run a pipeline script on its own process, inside the workdir
+
+    Returns:
+        dict with the wall time in seconds and the peak resident memory in MB of the process
+    """
+    log_path = workdir / f'{name}.log'
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen([sys.executable, str(ROOT / 'scripts' / f'{name}.py')] + arguments,
+                                   cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 returns the resources used by this process only
+        _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        print(log_path.read_text()[-3000:])
+        raise Exception(f'{name} failed with exit code {process.returncode}. Log at {log_path}')
+
+    # ru_maxrss is in kB on linux
+    return {'wall_time': round(wall_time, 3), 'peak_memory_mb': round(usage.ru_maxrss / 1024, 1)}
+
+
+def run_pipeline(size: int, args: dict, workdir: pathlib.Path) -> list:
+    """
+    Description:
+        Run all the stages against a new stand-in server with `size` scrobbles
+
+    Returns:
+        list with a dict of results per stage
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    apis = stand_in_apis(scrobbles=size, unique_tracks=int(size * args['unique_ratio']))
+    server = apis.register(stand_in_server(latency=args['latency'],
+                                           rate_limit_every=args['rate_limit_every'],
+                                           rate_limited_paths=('/v1/',))).start()
+
+    # The cached refresh token skips the browser authentication of the user api
+    credential_cache(filename='spotify_credentials', filepath=workdir / 'cache').set(
+        CLIENT_ID, {'refresh_token': 'stand-in-refresh-token', 'scope': PLAYLISTS_SCOPE})
+
+    env = dict(os.environ)
+    env.update(environment(server.url))
+    env.update({'PYTHONPATH': str(ROOT),
+                'LASTFM_USER': USER,
+                'LASTFM_API_KEY': 'stand-in-api-key',
+                'SPOTIFY_CLIENT_ID': CLIENT_ID,
+                'SPOTIFY_CLIENT_SECRET': 'stand-in-client-secret'})
+
+    results = []
+    try:
+        for name, arguments in stages(args):
+            before = dict(server.requests)
+            result = run_stage(name=name, arguments=arguments, workdir=workdir, env=env)
+            requests = {key: count - before.get(key, 0) for key, count in server.requests.items()
+                        if count - before.get(key, 0) > 0}
+            result.update({'stage': name, 'scrobbles': size, 'unique_tracks': apis.unique_tracks,
+                           'requests': sum(requests.values()), 'requests_by_endpoint': requests})
+            results.append(result)
+            print(f"{size:>9} {name:<20} {result['wall_time']:>9.2f}s {result['requests']:>9} requests "
+                  f"{result['peak_memory_mb']:>9.1f} MB")
+    finally:
+        server.stop()
+
+    return results
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    sizes = [int(size) for size in args['sizes'].split(',')]
+
+    temporary = None
+    if args['workdir'] is None:
+        temporary = tempfile.TemporaryDirectory()
+        workdir = pathlib.Path(temporary.name)
+    else:
+        workdir = pathlib.Path(args['workdir'])
+
+    print(f"{'scrobbles':>9} {'stage':<20} {'wall time':>10} {'requests':>18} {'peak memory':>12}")
+    results = []
+    try:
+        for size in sizes:
+            results += run_pipeline(size=size, args=args, workdir=workdir / str(size))
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    if args['output'] is not None:
+        with open(args['output'], 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,116 @@
+import json
+import time
+
+import argparse
+import requests as re
+
+from utils.spotify_api import page_uris
+from benchmarks.stand_in_apis import track_id
+
+
+def parse_args():
+    """
+    Parse arguments passed when calling the scripts
+
+    Returns a dict with all the arguments
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--pages', default=500, type=int,
+                        help='Number of pages parsed per scenario. Default is 500')
+    parser.add_argument('-o', '--output', default=None, type=str,
+                        help='If declared, the results are also saved on this json file')
+    return vars(parser.parse_args())
+
+
+def page_body(fields: bool = True, size: int = 100) -> bytes:
+    """
+    Returns the json body of a playlist tracks page with `size` songs
+    If fields, only the song uris and the next link are on the page (as requested with the fields parameter),
+        otherwise every item has a full track object, as the api returns without it
+    """
+
+    items = []
+    for number in range(size):
+        sp_id = track_id(number)
+        track = {'uri': f'spotify:track:{sp_id}'}
+        if not fields:
+            track.update({'id': sp_id, 'name': f'Song {number}', 'duration_ms': 200000, 'explicit': False,
+                          'popularity': 50, 'track_number': 1, 'disc_number': 1, 'type': 'track',
+                          'href': f'https://api.spotify.com/v1/tracks/{sp_id}',
+                          'external_urls': {'spotify': f'https://open.spotify.com/track/{sp_id}'},
+                          'available_markets': ['BR', 'DE', 'GB', 'US'] * 10,
+                          'artists': [{'id': track_id(number + 1), 'name': f'Artist {number}', 'type': 'artist',
+                                       'uri': f'spotify:artist:{track_id(number + 1)}'}],
+                          'album': {'id': track_id(number + 2), 'name': f'Album {number}', 'type': 'album',
+                                    'release_date': '2020-01-01', 'total_tracks': 10,
+                                    'images': [{'height': 640, 'width': 640,
+                                                'url': f'https://i.scdn.co/image/{sp_id}'}] * 3}})
+            track = {'added_at': '2020-01-01T00:00:00Z', 'is_local': False, 'track': track}
+        else:
+            track = {'track': track}
+        items.append(track)
+
+    page = {'items': items, 'next': 'https://api.spotify.com/v1/playlists/playlist/tracks?offset=100&limit=100'}
+    if not fields:
+        page.update({'href': 'https://api.spotify.com/v1/playlists/playlist/tracks', 'limit': 100,
+                     'offset': 0, 'previous': None, 'total': 1000})
+    return json.dumps(page).encode('utf-8')
+
+
+def response(body: bytes) -> re.Response:
+    """
+    Returns a requests response with the body, so r.json() parses it as on a real request
+    """
+    r = re.Response()
+    r.status_code = 200
+    r._content = body
+    r.encoding = 'utf-8'
+    return r
+
+
+def before(r: re.Response) -> list:
+    # previous get_playlist_songs: the body is parsed again for every song of the page
+    return [r.json()['items'][i]['track']['uri']
+            for i in range(len(r.json()['items']))]
+
+
+def after(r: re.Response) -> list:
+    # iter_playlist_songs: the body is parsed once per page
+    return page_uris(r.json())
+
+
+def cpu_per_page(func, body: bytes, pages: int) -> float:
+    """
+    Returns the cpu time in microseconds to parse a page and get its song uris
+    """
+
+    start = time.process_time()
+    for _ in range(pages):
+        func(response(body))
+    return (time.process_time() - start) / pages * 1e6
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    results = []
+    print(f"{'page body':<12} {'body size':>10} {'before':>14} {'after':>14} {'speedup':>8}")
+    for fields in [False, True]:
+        body = page_body(fields=fields)
+        assert before(response(body)) == after(response(body))
+        # Parsing is much slower before, so it gets fewer pages to keep the run short
+        cpu_before = cpu_per_page(before, body=body, pages=max(args['pages'] // 20, 1))
+        cpu_after = cpu_per_page(after, body=body, pages=args['pages'])
+        name = 'fields' if fields else 'full'
+        results.append({'page_body': name, 'body_bytes': len(body),
+                        'before_us_per_page': round(cpu_before, 1), 'after_us_per_page': round(cpu_after, 1)})
+        print(f"{name:<12} {len(body):>10} {cpu_before:>11.1f} us {cpu_after:>11.1f} us {cpu_before / cpu_after:>7.1f}x")
+
+    # before: a request for the total plus a request per page, now the pages follow the next links only
+    print("Requests per playlist of n pages: before n + 1, after n")
+
+    if args['output'] is not None:
+        with open(args['output'], 'w') as f:
+            json.dump(results, f, indent=2)
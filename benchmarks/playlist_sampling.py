@@ -0,0 +1,74 @@
+import json
+import time
+
+import argparse
+import numpy as np
+import pandas as pd
+
+from utils.sampling import sampling_weights, sample_clusters
+
+
+def parse_args():
+    """
+    Parse arguments passed when calling the scripts
+
+    Returns a dict with all the arguments
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--songs', default=1000000, type=int,
+                        help='Number of clusterized songs. Default is 1000000')
+    parser.add_argument('-k', '--clusters', default='10,50,200', type=str,
+                        help='Comma separated numbers of clusters to sample from. Default is 10,50,200')
+    parser.add_argument('-l', '--lenght', default=150, type=int,
+                        help='Number of songs per playlist. Default is 150')
+    parser.add_argument('-o', '--output', default=None, type=str,
+                        help='If declared, the results are also saved on this json file')
+    return vars(parser.parse_args())
+
+
+def before(df: pd.DataFrame, lenght: int) -> dict:
+    # previous create_playlists: a boolean scan of all the songs per cluster (small clusters are capped to run at all)
+    samples = {}
+    for key in df['cluster'].unique():
+        tempdf = df[df['cluster'] == key]
+        samples[key] = tempdf.sample(n=min(lenght, len(tempdf.index)))['id'].to_numpy()
+    return samples
+
+
+def after(df: pd.DataFrame, lenght: int, weights: np.ndarray = None) -> dict:
+    # sample_clusters: all the clusters in a single pass
+    ids = df['id'].to_numpy()
+    samples = sample_clusters(clusters=df['cluster'].to_numpy(), n=lenght, weights=weights)
+    return {key: ids[positions] for key, positions in samples.items()}
+
+
+def timed(func, **kwargs) -> float:
+    start = time.perf_counter()
+    func(**kwargs)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    rng = np.random.default_rng(1)
+
+    results = []
+    print(f"{'songs':>9} {'clusters':>9} {'before':>10} {'after':>10} {'weighted':>10}")
+    for clusters in [int(k) for k in args['clusters'].split(',')]:
+        df = pd.DataFrame({'cluster': rng.integers(0, clusters, args['songs']),
+                           'id': np.arange(args['songs']),
+                           'play_count': rng.integers(1, 100, args['songs'])})
+        weights = sampling_weights(df=df, strategy='play_count')
+        result = {'songs': args['songs'], 'clusters': clusters, 'lenght': args['lenght'],
+                  'before_seconds': round(timed(before, df=df, lenght=args['lenght']), 4),
+                  'after_seconds': round(timed(after, df=df, lenght=args['lenght']), 4),
+                  'after_weighted_seconds': round(timed(after, df=df, lenght=args['lenght'], weights=weights), 4)}
+        results.append(result)
+        print(f"{args['songs']:>9} {clusters:>9} {result['before_seconds']:>9.3f}s {result['after_seconds']:>9.3f}s "
+              f"{result['after_weighted_seconds']:>9.3f}s")
+
+    if args['output'] is not None:
+        with open(args['output'], 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,321 @@
+import json
+import time
+import random
+import hashlib
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from urllib.parse import parse_qs, urlencode
+
+import argparse
+
+from benchmarks.stand_in_server import stand_in_server
+
+
+def track_id(number: int) -> str:
+    """
+    Returns:
+        string with a deterministic 22 characters spotify-like id for the synthetic track number
+    """
+    return hashlib.md5(f'track-{number}'.encode('utf-8')).hexdigest()[:22]
+
+
+class stand_in_apis(object):
+    """
+    Description:
+        Deterministic synthetic Last.fm and Spotify apis, served by a stand_in_server
+        The same arguments always generate the same scrobbles, search results, song features and ids
+        Playlists are kept in memory, so the playlist endpoints behave as the real ones on a single run
+
+    Arguments:
+        scrobbles:
+            Number of scrobbles of the synthetic user
+
+        unique_tracks:
+            Number of distinct (artist, song). If None, one fifth of the scrobbles
+            Plays are skewed: a few tracks are played many times, as on a real history
+
+        start:
+            Date of the first scrobble on YYYYMMDD format
+
+        interval:
+            Seconds in between two scrobbles
+
+        not_found_every:
+            Every nth track is not found on the spotify search
+
+        seed:
+            Seed of the synthetic data
+    """
+
+    def __init__(self, scrobbles: int = 10000, unique_tracks: int = None, start: str = '20200101',
+                 interval: int = 180, not_found_every: int = 20, seed: int = 1) -> object:
+        self.unique_tracks = max(1, unique_tracks or scrobbles // 5)
+        self.not_found_every = not_found_every
+        self.user_id = 'stand_in_user'
+
+        # Tracks: some Last.fm titles carry a release suffix that is not on the Spotify title
+        artists = max(1, self.unique_tracks // 8)
+        self.tracks = []
+        self.index = {}
+        for number in range(self.unique_tracks):
+            artist = f'Artist {number % artists}'
+            song = f'Song {number}'
+            played_song = f'{song} - Remastered 2011' if number % 7 == 3 else song
+            self.tracks.append((artist, song, played_song))
+            self.index[(artist, played_song)] = number
+        self.ids = {track_id(number): number for number in range(self.unique_tracks)}
+
+        # Scrobbles, sorted by timestamp
+        rng = random.Random(seed)
+        first = int(time.mktime(datetime.strptime(start, '%Y%m%d').timetuple()))
+        self.timestamps = [first + i * interval for i in range(scrobbles)]
+        self.played = [int(self.unique_tracks * rng.random() ** 2) for _ in range(scrobbles)]
+
+        self.playlists = {}
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"Stand-in apis with {len(self.timestamps)} scrobbles of {self.unique_tracks} tracks"
+
+    def register(self, server: stand_in_server) -> stand_in_server:
+        """
+        Description:
+            Add the api routes to a stand-in server
+
+        Returns:
+            The server itself
+        """
+        server.add_route('GET', '/2.0/', self.recent_tracks)
+        server.add_route('POST', '/api/token', self.token)
+        server.add_route('GET', '/v1/search', self.search)
+        server.add_route('GET', '/v1/audio-features', self.audio_features)
+        server.add_route('GET', '/v1/me', self.me)
+        server.add_route('GET', '/v1/me/playlists', self.list_playlists)
+        server.add_route('POST', '/v1/users/{user}/playlists', self.create_playlist)
+        server.add_route('GET', '/v1/playlists/{playlist}', self.get_playlist)
+        server.add_route('GET', '/v1/playlists/{playlist}/tracks', self.playlist_tracks)
+        server.add_route('POST', '/v1/playlists/{playlist}/tracks', self.add_tracks)
+        server.add_route('PUT', '/v1/playlists/{playlist}/tracks', self.replace_tracks)
+        server.add_route('DELETE', '/v1/playlists/{playlist}/tracks', self.delete_tracks)
+        return server
+
+    # Last.fm
+
+    def recent_tracks(self, handler, query, body):
+        if query.get('method', [''])[0] != 'user.getrecenttracks':
+            return 400, {'error': 3, 'message': 'Invalid Method'}, {}
+
+        limit = int(query.get('limit', ['50'])[0])
+        page = int(query.get('page', ['1'])[0])
+        first = bisect_left(self.timestamps, int(query['from'][0])) if 'from' in query else 0
+        last = bisect_right(self.timestamps, int(query['to'][0])) if 'to' in query else len(self.timestamps)
+        total = max(0, last - first)
+
+        # Newest scrobbles first
+        end = last - (page - 1) * limit
+        start = max(first, end - limit)
+        tracks = []
+        for position in range(end - 1, start - 1, -1):
+            artist, _, played_song = self.tracks[self.played[position]]
+            tracks.append({'artist': {'#text': artist},
+                           'name': played_song,
+                           'date': {'uts': str(self.timestamps[position])}})
+
+        return 200, {'recenttracks': {'track': tracks,
+                                      '@attr': {'user': query.get('user', [''])[0],
+                                                'page': str(page),
+                                                'perPage': str(limit),
+                                                'totalPages': str(-(-total // limit)),
+                                                'total': str(total)}}}, {}
+
+    # Spotify accounts
+
+    def token(self, handler, query, body):
+        form = parse_qs(body.decode('utf-8'))
+        token = {'access_token': f'stand-in-{time.monotonic_ns()}',
+                 'token_type': 'Bearer',
+                 'expires_in': 3600}
+        if form.get('grant_type', [''])[0] == 'authorization_code':
+            token['refresh_token'] = 'stand-in-refresh-token'
+        return 200, token, {}
+
+    # Spotify api
+
+    def search(self, handler, query, body):
+        q = query.get('q', [''])[0]
+        artist, _, song = q.partition(' track:')
+        number = self.index.get((artist.replace('artist:', '', 1), song))
+
+        items = []
+        if number is not None and number % self.not_found_every != 0:
+            artist, song, _ = self.tracks[number]
+            items.append({'id': track_id(number),
+                          'name': song,
+                          'popularity': 50,
+                          'artists': [{'name': artist}],
+                          'album': {'artists': [{'name': artist}]}})
+        return 200, {'tracks': {'items': items, 'total': len(items)}}, {}
+
+    def features(self, sp_id: str) -> dict:
+        number = self.ids.get(sp_id)
+        if number is None:
+            return None
+        rng = random.Random(number)
+        return {'danceability': rng.random(), 'energy': rng.random(), 'key': rng.randint(0, 11),
+                'loudness': -rng.random() * 30, 'mode': rng.randint(0, 1), 'speechiness': rng.random() / 2,
+                'acousticness': rng.random(), 'instrumentalness': rng.random(), 'liveness': rng.random(),
+                'valence': rng.random(), 'tempo': 60 + rng.random() * 120, 'type': 'audio_features',
+                'id': sp_id, 'uri': f'spotify:track:{sp_id}',
+                'track_href': f'https://api.spotify.com/v1/tracks/{sp_id}',
+                'analysis_url': f'https://api.spotify.com/v1/audio-analysis/{sp_id}',
+                'duration_ms': rng.randint(90000, 480000), 'time_signature': 4}
+
+    def audio_features(self, handler, query, body):
+        ids = query.get('ids', [''])[0].split(',')
+        if len(ids) > 100:
+            return 400, {'error': {'status': 400, 'message': 'Too many ids requested'}}, {}
+        return 200, {'audio_features': [self.features(sp_id) for sp_id in ids]}, {}
+
+    def me(self, handler, query, body):
+        return 200, {'id': self.user_id, 'display_name': 'Stand-in user'}, {}
+
+    # Spotify playlists
+
+    def snapshot(self, playlist: str) -> str:
+        return f"{playlist}-{self.playlists[playlist]['version']}"
+
+    def summary(self, playlist: str) -> dict:
+        return {'id': playlist,
+                'name': self.playlists[playlist]['name'],
+                'snapshot_id': self.snapshot(playlist),
+                'tracks': {'total': len(self.playlists[playlist]['uris'])}}
+
+    def list_playlists(self, handler, query, body):
+        with self.lock:
+            items = [self.summary(playlist) for playlist in self.playlists]
+        return 200, {'items': items, 'total': len(items), 'next': None}, {}
+
+    def create_playlist(self, handler, query, body):
+        data = json.loads(body or b'{}')
+        with self.lock:
+            playlist = f'standinplaylist{len(self.playlists):07d}'
+            self.playlists[playlist] = {'name': data.get('name', ''), 'uris': [], 'version': 0}
+            return 201, self.summary(playlist), {}
+
+    def get_playlist(self, handler, query, body):
+        playlist = handler.params['playlist']
+        with self.lock:
+            if playlist not in self.playlists:
+                return 404, {'error': {'status': 404, 'message': 'Not found.'}}, {}
+            return 200, self.summary(playlist), {}
+
+    def playlist_tracks(self, handler, query, body):
+        playlist = handler.params['playlist']
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', ['100'])[0])
+        with self.lock:
+            if playlist not in self.playlists:
+                return 404, {'error': {'status': 404, 'message': 'Not found.'}}, {}
+            uris = self.playlists[playlist]['uris']
+            total = len(uris)
+            items = [{'track': {'uri': uri, 'id': uri.split(':')[-1]}}
+                     for uri in uris[offset:offset + limit]]
+
+        next_url = None
+        if offset + limit < total:
+            next_query = {key: values[0] for key, values in query.items()}
+            next_query.update({'offset': offset + limit, 'limit': limit})
+            next_url = f'https://api.spotify.com/v1/playlists/{playlist}/tracks?{urlencode(next_query)}'
+        return 200, {'items': items, 'total': total, 'offset': offset, 'limit': limit, 'next': next_url}, {}
+
+    def add_tracks(self, handler, query, body):
+        playlist = handler.params['playlist']
+        uris = json.loads(body or b'{}').get('uris', [])
+        if len(uris) > 100:
+            return 400, {'error': {'status': 400, 'message': 'Too many tracks requested'}}, {}
+        with self.lock:
+            if playlist not in self.playlists:
+                return 404, {'error': {'status': 404, 'message': 'Not found.'}}, {}
+            self.playlists[playlist]['uris'].extend(uris)
+            self.playlists[playlist]['version'] += 1
+            return 201, {'snapshot_id': self.snapshot(playlist)}, {}
+
+    def replace_tracks(self, handler, query, body):
+        playlist = handler.params['playlist']
+        uris = json.loads(body or b'{}').get('uris', [])
+        if len(uris) > 100:
+            return 400, {'error': {'status': 400, 'message': 'Too many tracks requested'}}, {}
+        with self.lock:
+            if playlist not in self.playlists:
+                return 404, {'error': {'status': 404, 'message': 'Not found.'}}, {}
+            self.playlists[playlist]['uris'] = list(uris)
+            self.playlists[playlist]['version'] += 1
+            return 200, {'snapshot_id': self.snapshot(playlist)}, {}
+
+    def delete_tracks(self, handler, query, body):
+        playlist = handler.params['playlist']
+        uris = set(track['uri'] for track in json.loads(body or b'{}').get('tracks', []))
+        if len(uris) > 100:
+            return 400, {'error': {'status': 400, 'message': 'Too many tracks requested'}}, {}
+        with self.lock:
+            if playlist not in self.playlists:
+                return 404, {'error': {'status': 404, 'message': 'Not found.'}}, {}
+            self.playlists[playlist]['uris'] = [uri for uri in self.playlists[playlist]['uris']
+                                                if uri not in uris]
+            self.playlists[playlist]['version'] += 1
+            return 200, {'snapshot_id': self.snapshot(playlist)}, {}
+
+
+def environment(url: str) -> dict:
+    """
+    Returns:
+        dict with the environment variables that point the scripts to a stand-in server
+    """
+    return {'LASTFM_API_URL': url,
+            'SPOTIFY_API_URL': url,
+            'SPOTIFY_ACCOUNTS_URL': url}
+
+
+def parse_args():
+    """
+    Parse arguments passed when calling the scripts
+
+    Returns a dict with all the arguments
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--scrobbles', default=10000, type=int,
+                        help='Number of synthetic scrobbles. Default is 10000')
+    parser.add_argument('-u', '--unique_tracks', default=None, type=int,
+                        help='Number of distinct tracks. Default is one fifth of the scrobbles')
+    parser.add_argument('-p', '--port', default=8000, type=int,
+                        help='Port to listen on. Default is 8000')
+    parser.add_argument('--latency', default=0, type=float,
+                        help='Seconds added to every response. Default is 0')
+    parser.add_argument('--rate_limit_every', default=0, type=int,
+                        help='If declared, every nth request is answered with a 429 status')
+    parser.add_argument('--retry_after', default=1, type=float,
+                        help='Seconds sent on the Retry-After header of the 429 responses. Default is 1')
+    return vars(parser.parse_args())
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    apis = stand_in_apis(scrobbles=args['scrobbles'],
+                         unique_tracks=args['unique_tracks'])
+    server = stand_in_server(port=args['port'],
+                             latency=args['latency'],
+                             rate_limit_every=args['rate_limit_every'],
+                             retry_after=args['retry_after'])
+    apis.register(server)
+
+    print(f"{apis} on {server.url}. Point the scripts to it with:")
+    for key, value in environment(server.url).items():
+        print(f"export {key}={value}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,190 @@
+import re
+import json
+import time
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class stand_in_handler(BaseHTTPRequestHandler):
+    """
+    Description:
+        Request handler of the local stand-in server.
+        Keep-alive is supported (HTTP/1.1 with Content-Length), so connection reuse can be measured.
+        Routes are looked up on the server `routes` dict, keyed by (method, path), then on the path patterns
+            added with `add_route`. The values of the pattern placeholders are set on `handler.params`
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, so Nagle's algorithm would delay every keep-alive response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_any(self, method: str):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        number = self.server.count(method, url.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        route, self.params = self.server.route(method, url.path)
+        if route is None:
+            status, payload, headers = 404, {'error': {'status': 404, 'message': 'Not found'}}, {}
+        elif self.server.rate_limited(url.path) and number % self.server.rate_limit_every == 0:
+            status, payload = 429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}}
+            headers = {'Retry-After': str(self.server.retry_after)}
+        else:
+            status, payload, headers = route(self, parse_qs(url.query), body)
+
+        data = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.handle_any('GET')
+
+    def do_POST(self):
+        self.handle_any('POST')
+
+    def do_PUT(self):
+        self.handle_any('PUT')
+
+    def do_DELETE(self):
+        self.handle_any('DELETE')
+
+
+def ping(handler, query, body):
+    return 200, {'ok': True}, {}
+
+
+class stand_in_server(ThreadingHTTPServer):
+    """
+    Description:
+        Local HTTP server standing in for the external apis, so the clients can be exercised without credentials
+
+    Arguments:
+        port:
+            Port to listen on. If 0, a free port is chosen
+
+        latency:
+            Seconds added to every response
+
+        rate_limit_every:
+            If set, every nth request is answered with a 429 (rate limited) status
+
+        retry_after:
+            Seconds sent on the Retry-After header of the 429 responses
+
+        rate_limited_paths:
+            Path prefixes where the 429 responses are injected. If None, on all paths
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, port: int = 0, latency: float = 0, rate_limit_every: int = 0, retry_after: float = 0,
+                 rate_limited_paths: tuple = None) -> object:
+        super().__init__(('127.0.0.1', port), stand_in_handler)
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.rate_limited_paths = rate_limited_paths
+        self.routes = {('GET', '/ping'): ping}
+        self.patterns = []
+        self.requests = {}
+        self.total_requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def __str__(self):
+        return f"Stand-in server at {self.url}"
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def add_route(self, method: str, path: str, func) -> None:
+        """
+        Description:
+            Add a route. Path segments between braces are placeholders (e.g. "/v1/playlists/{playlist}/tracks")
+
+        Arguments:
+            method(string):
+                The http method
+
+            path(string):
+                The route path
+
+            func:
+                Function called as func(handler, query, body), returning a (status, payload, headers) tuple
+
+        Returns:
+            None
+        """
+        if '{' not in path:
+            self.routes[(method, path)] = func
+            return
+        pattern = re.sub(r'\{(\w+)\}', r'(?P<\1>[^/]+)', path)
+        self.patterns.append((method, re.compile(f'^{pattern}$'), path, func))
+
+    def rate_limited(self, path: str) -> bool:
+        if not self.rate_limit_every:
+            return False
+        return self.rate_limited_paths is None or path.startswith(tuple(self.rate_limited_paths))
+
+    def route(self, method: str, path: str) -> tuple:
+        """
+        Returns:
+            tuple with the route function (None if not found) and a dict with the placeholder values
+        """
+        route = self.routes.get((method, path))
+        if route is not None:
+            return route, {}
+        for route_method, pattern, _, func in self.patterns:
+            match = pattern.match(path)
+            if route_method == method and match:
+                return func, match.groupdict()
+        return None, {}
+
+    def count(self, method: str, path: str) -> int:
+        """
+        Description:
+            Count a request. Requests on pattern routes are counted by the pattern (e.g. "POST /v1/playlists/{playlist}/tracks")
+
+        Returns:
+            int with the number of requests received so far
+        """
+        for route_method, pattern, route_path, _ in self.patterns:
+            if route_method == method and pattern.match(path):
+                path = route_path
+                break
+        with self.lock:
+            key = f'{method} {path}'
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.total_requests += 1
+            return self.total_requests
+
+    def start(self) -> 'stand_in_server':
+        """
+        Description:
+            Serve on a background thread
+
+        Returns:
+            The server itself
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -1,13 +1,26 @@
 import os
+import time
+import uuid
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 import argparse
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
 from sklearn.preprocessing import MinMaxScaler
 from utils.utils import *
+from utils.track_index import track_index
+from utils.catalog import track_catalog
+
+
+# Spotify features loaded for the clusterization
+FEATURES_COLUMNS = ['danceability', 'energy', 'loudness', 'speechiness', 'acousticness', 'instrumentalness',
+                    'liveness', 'valence', 'tempo', 'id', 'duration_ms', 'time_signature']
+# Columns of the joined data that are not used as clusterization features
+NOT_FEATURES = ['artist', 'song', 'id', 'duration_ms', 'time_signature', 'no_id', 'tempo', 'play_count', 'last_played']
 
 
 def parse_args():
@@ -18,64 +31,437 @@ def parse_args():
     """
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('clusters', type=int,
-                        help='Number of clusters to be generated')
+    parser.add_argument('clusters', type=int, nargs='?', default=None,
+                        help='Number of clusters to be generated. Required if --auto_k is not declared')
     parser.add_argument('-r', '--random_state', default=1, type=int,
                         help='Your lucky number (random state for the Kmeans model). Default is 1')
     parser.add_argument('-a', '--algorithm', default='auto', type=str,
                         help="Algorithm for the KMeans clusterization. Check the documentation for more info: https://scikit-learn.org/stable/modules/generated/sklearn.cluster.KMeans.html")
-    return vars(parser.parse_args())
+    parser.add_argument('-w', '--weighted', action='store_true',
+                        help='If declared, the play counts are used as sample weights, so the most played songs weigh more on the clusters')
+    parser.add_argument('-s', '--streaming', action='store_true',
+                        help='If declared, a mini-batch kmeans model is kept in between runs and only updated with the new songs')
+    parser.add_argument('-b', '--batch_size', default=1024, type=int,
+                        help='Number of songs per mini-batch on the streaming mode. Default is 1024')
+    parser.add_argument('-f', '--full_refit', action='store_true',
+                        help='If declared on the streaming mode, the model is fitted again from scratch with all the songs')
+    parser.add_argument('-k', '--auto_k', '--auto-k', action='store_true',
+                        help='If declared, the number of clusters is chosen automatically (elbow and silhouette scores)')
+    parser.add_argument('--k_range', default='2,10', type=str,
+                        help='Minimum and maximum number of clusters evaluated on the auto k mode. Default is 2,10')
+    parser.add_argument('--sample_size', default=10000, type=int,
+                        help='Number of songs sampled to compute the silhouette scores on the auto k mode. Default is 10000')
+    parser.add_argument('--assign', action='store_true',
+                        help='If declared, only the songs not clusterized yet are assigned to the nearest cluster of the saved model (no fit)')
+    parser.add_argument('-j', '--jobs', default=None, type=int,
+                        help='Number of processes evaluating the number of clusters on the auto k mode. Default is the number of cpus')
+    args = parser.parse_args()
+    if args.clusters is None and not (args.auto_k or args.assign):
+        parser.error('the number of clusters is required (or declare --auto_k or --assign)')
+    k_range = args.k_range
+    try:
+        args.k_range = tuple(int(k) for k in k_range.split(','))
+    except ValueError:
+        parser.error(f'--k_range must be two comma separated integers, not {k_range}')
+    if len(args.k_range) != 2 or not 2 <= args.k_range[0] <= args.k_range[1]:
+        parser.error(f'--k_range must be two comma separated integers with 2 <= min <= max, not {k_range}')
+    if args.auto_k and args.sample_size <= args.k_range[1]:
+        parser.error('--sample_size must be bigger than the maximum number of clusters of --k_range')
+    return vars(args)
 
 
-if __name__ == "__main__":
+def load_data(user: str, filepath: str = './data') -> tuple:
+    """
+    Load the clusterization inputs: the played tracks, the song features catalog and the spotify ids of the played tracks
+    Scrobbles are aggregated to the unique played tracks before anything else
 
-    load_dotenv()
-    user = os.environ.get("LASTFM_USER")
+    Returns a tuple with the (played dataframe, features track_catalog, ids dataframe)
+    """
 
-    warnings.filterwarnings("ignore")
-    args = parse_args()
+    # Load only the columns used on the clusterization (the url and string columns are not needed)
+    catalog = track_catalog.load(filepath=filepath,
+                                 feature_columns=FEATURES_COLUMNS,
+                                 tracks=False)
+    played = load_user_results(filename='lastfm_played_tracks', user=user, filepath=filepath,
+                               columns=['artist', 'song', 'unix_timestamp'])
+    played = aggregate_plays(played)
+    ids = track_index(filepath=filepath).lookup(played)
+    return played, catalog, ids
+
+
+def aggregate_plays(played: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregate the scrobbles (one row per play) to the unique played tracks
 
-    features = load_results(filename='spotify_songs_features')
-    played = load_user_results(filename='lastfm_played_tracks', user=user)
-    ids = load_results(filename='spotify_tracks_ids')
+    Returns a dataframe with artist, song, play_count and last_played (unix timestamp) columns
+    """
+
+    return played.groupby(['artist', 'song'], sort=False).agg(
+        play_count=('unix_timestamp', 'size'),
+        last_played=('unix_timestamp', 'max')).reset_index()
 
-    # Dataprep - join the data from multiple sources on a single DF
-    df = played.join(features.join(ids.set_index('sp_id'), on='id').set_index(
-        ['artist', 'song']), on=['artist', 'song'], how='inner')
-    df.drop(columns=['unix_timestamp', 'key', 'mode', 'type',
-                     'uri', 'track_href', 'analysis_url'],
-            axis=1,
-            inplace=True)
-    df.drop_duplicates(inplace=True)
 
-    # Remove features not bo be used -it can be adjusted by the user
-    df.drop(columns=['speechiness', 'liveness', 'danceability'],
-            axis=1,
-            inplace=True)
+def join_data(played: pd.DataFrame, catalog: track_catalog, ids: pd.DataFrame) -> pd.DataFrame:
+    """
+    Join the data from multiple sources on a single dataframe
+    The played tracks are already unique, so the join runs over one row per track instead of one per play
+    The features of each spotify id are found with a binary search on the catalog, instead of a join on string ids
+
+    Returns a dataframe with the played tracks, their play counts and their features
+    """
+
+    df = played.merge(ids, on=['artist', 'song'], how='inner')
+    rows = catalog.feature_rows(df['sp_id'])
+    found = rows >= 0
+    features = catalog.features_frame(rows=rows[found])
+    df = df[found].reset_index(drop=True)
+    # Same column order as the previous join: played columns, features (in the dataset order) and the no_id flag
+    features = features[[column for column in FEATURES_COLUMNS if column in features]]
+    return pd.concat([df.drop(columns=['sp_id', 'no_id']), features, df[['no_id']]], axis=1)
+
+
+def dedupe_data(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Remove the repeated tracks and the features not to be used (it can be adjusted by the user)
+
+    Returns the deduplicated dataframe
+    """
+
+    df = df.drop_duplicates()
+    return df.drop(columns=['speechiness', 'liveness', 'danceability'])
+
+
+def scale_features(df: pd.DataFrame, scaler: MinMaxScaler = None) -> tuple:
+    """
+    Select the features used on the clusterization and normalize them to values between 0 and 1
+    If a fitted scaler is passed, it is used as it is (e.g. the scaler of a persisted model)
+
+    Returns a tuple with a numpy array of the scaled features and the scaler
+    """
 
     # Removing the columns not to be used on the clusterization
-    X = df.drop(columns=['artist', 'song', 'id', 'duration_ms',
-                'time_signature', 'no_id', 'tempo'], axis=1)
+    X = df[feature_columns(df)]
+
+    if scaler is None:
+        scaler = MinMaxScaler()
+        scaler.fit(X)
+    return scaler.transform(X), scaler
 
-    # Normalize all features to values between 0 and 1
-    scaler = MinMaxScaler()
-    scaler.fit(X)
-    X = scaler.transform(X)
 
-    kmeans = KMeans(
-        n_clusters=args['clusters'],
+def feature_columns(df: pd.DataFrame) -> list:
+    """
+    Returns a list with the columns used as clusterization features, in order
+    """
+
+    return [column for column in df.columns if column not in NOT_FEATURES]
+
+
+def fit_clusters(X: np.ndarray, clusters: int, random_state: int = 1, algorithm: str = 'auto',
+                 sample_weight: np.ndarray = None) -> KMeans:
+    """
+    Fit the KMeans model on the scaled features
+    If sample_weight is passed (e.g. the play counts), each track weighs that much on the centroids
+
+    Returns the fitted KMeans model (the cluster of each track is on labels_)
+    """
+
+    kmeans = kmeans_model(clusters=clusters, random_state=random_state, algorithm=algorithm)
+    kmeans.fit(X, sample_weight=sample_weight)
+    return kmeans
+
+
+def kmeans_model(clusters: int, random_state: int = 1, algorithm: str = 'auto') -> KMeans:
+    return KMeans(
+        n_clusters=clusters,
         init="random",
         max_iter=10000,
-        random_state=args['random_state'],
-        algorithm=args['algorithm'])
-    kmeans.fit(X)
+        random_state=random_state,
+        algorithm=algorithm)
+
+
+def stratified_sample(labels: np.ndarray, size: int, random_state: int = 1) -> np.ndarray:
+    """
+    Sample positions of each cluster proportionally to its size (at least one per cluster),
+        so small clusters are represented on the silhouette score
+
+    Returns a numpy array with the sampled positions
+    """
+
+    if len(labels) <= size:
+        return np.arange(len(labels))
+
+    rng = np.random.default_rng(random_state)
+    sample = []
+    for label in np.unique(labels):
+        positions = np.flatnonzero(labels == label)
+        n = min(len(positions), max(1, round(size * len(positions) / len(labels))))
+        sample.append(rng.choice(positions, size=n, replace=False))
+    return np.concatenate(sample)
+
+
+# Data shared by the auto k worker processes, set once per process by init_worker
+_worker_data = {}
+
+
+def init_worker(X: np.ndarray, sample_weight: np.ndarray, sample_size: int, random_state: int, algorithm: str) -> None:
+    _worker_data.update({'X': X, 'sample_weight': sample_weight, 'sample_size': sample_size,
+                         'random_state': random_state, 'algorithm': algorithm})
+
+
+def evaluate_k(clusters: int) -> dict:
+    """
+    Fit the KMeans model with a number of clusters and score it (on a worker process)
+
+    Returns a dict with the number of clusters, the inertia and the silhouette score of a stratified sample
+    """
+
+    X = _worker_data['X']
+    kmeans = kmeans_model(clusters=clusters,
+                          random_state=_worker_data['random_state'],
+                          algorithm=_worker_data['algorithm'])
+    kmeans.fit(X, sample_weight=_worker_data['sample_weight'])
+
+    sample = stratified_sample(labels=kmeans.labels_,
+                               size=_worker_data['sample_size'],
+                               random_state=_worker_data['random_state'])
+    silhouette = silhouette_score(X[sample], kmeans.labels_[sample])
+    return {'k': clusters, 'inertia': float(kmeans.inertia_), 'silhouette': float(silhouette)}
+
+
+def choose_k(X: np.ndarray, k_range: tuple = (2, 10), sample_size: int = 10000, random_state: int = 1,
+             algorithm: str = 'auto', sample_weight: np.ndarray = None, jobs: int = None) -> tuple:
+    """
+    Evaluate a range of number of clusters in parallel (one process per k) and choose the best one
+    Each k gets an elbow score (distance of its inertia to the line in between the first and last inertias,
+        normalized from 0 to 1) and a normalized silhouette score. The chosen k has the highest average of both
+
+    Returns a tuple with the chosen number of clusters and a dataframe with the scores per k
+    """
+
+    ks = list(range(k_range[0], k_range[1] + 1))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(X, sample_weight, sample_size, random_state, algorithm)) as executor:
+        scores = pd.DataFrame(list(executor.map(evaluate_k, ks)))
+
+    # Elbow: distance of each (k, inertia) to the chord from the first to the last k, on normalized axes
+    k = (scores['k'] - scores['k'].min()) / max(scores['k'].max() - scores['k'].min(), 1)
+    inertia = (scores['inertia'] - scores['inertia'].min()) / \
+        max(scores['inertia'].max() - scores['inertia'].min(), 1e-12)
+    chord = (1 - k) - inertia
+    scores['elbow_score'] = chord / max(chord.max(), 1e-12)
+
+    silhouette = scores['silhouette']
+    scores['silhouette_score'] = (silhouette - silhouette.min()) / max(silhouette.max() - silhouette.min(), 1e-12)
+    scores['score'] = (scores['elbow_score'].clip(lower=0) + scores['silhouette_score']) / 2
+
+    chosen = int(scores.loc[scores['score'].idxmax(), 'k'])
+    scores['chosen'] = scores['k'] == chosen
+    return chosen, scores
+
+
+def stream_clusters(df: pd.DataFrame, clusters: int, user: str, filepath: str = './data', random_state: int = 1,
+                    batch_size: int = 1024, full_refit: bool = False, weighted: bool = False) -> np.ndarray:
+    """
+    Streaming clusterization with a mini-batch kmeans model kept in between runs (clusterization_state.pkl)
+    Only the songs not clusterized yet are scaled and used to update the model (partial_fit), in batches of batch_size songs,
+        and the previously clusterized songs keep their clusters
+    The model is fitted from scratch if there is no state yet, if the number of clusters changed, if full_refit is True
+        or if the saved clusters come from another fit (e.g. a full fit ran after the last streaming run)
+
+    Returns a numpy array with the cluster of each track
+    """
+
+    user_path = f'{filepath}/users/{user}'
+    state = load_model(filename='clusterization_state', filepath=user_path)
+    artifact = load_model(filename='clusterization_model', filepath=user_path)
+    known = None
+    # The saved clusters (and the cluster model saved with them) must come from the streaming model itself
+    same_fit = state is not None and artifact is not None and \
+        state.get('fit_id') is not None and state.get('fit_id') == artifact.get('fit_id')
+    if same_fit and not full_refit and state['model'].n_clusters == clusters:
+        known = known_clusters(df=df, user=user, filepath=filepath)
+    weights = df['play_count'].values if weighted else None
+
+    if known is None:
+        print(f"Fitting the streaming model from scratch with {len(df)} songs")
+        X, scaler = scale_features(df)
+        model = MiniBatchKMeans(n_clusters=clusters,
+                                batch_size=batch_size,
+                                random_state=random_state)
+        model.fit(X, sample_weight=weights)
+        fit_id = uuid.uuid4().hex
+        save_model(filename='clusterization_state',
+                   model={'scaler': scaler, 'model': model, 'updates': 0, 'fit_id': fit_id},
+                   filepath=user_path)
+        save_cluster_model(scaler=scaler, features=feature_columns(df), centroids=model.cluster_centers_,
+                           user=user, filepath=filepath, fit_id=fit_id)
+        return model.labels_
+
+    labels, new = known
+    print(f"Updating the streaming model with {new.sum()} new songs ({len(df) - new.sum()} already clusterized)")
+
+    model = state['model']
+    new_tracks = df[new]
+    positions = np.flatnonzero(new)
+    for start in range(0, len(new_tracks), batch_size):
+        batch = new_tracks.iloc[start:start + batch_size]
+        X, _ = scale_features(batch, scaler=state['scaler'])
+        model.partial_fit(X, sample_weight=batch['play_count'].values if weighted else None)
+        labels[positions[start:start + batch_size]] = model.predict(X).astype(str)
 
-    df['cluster'] = kmeans.labels_
+    state.update({'model': model, 'updates': state['updates'] + 1})
+    save_model(filename='clusterization_state', model=state, filepath=user_path)
+    save_cluster_model(scaler=state['scaler'], features=feature_columns(df), centroids=model.cluster_centers_,
+                       user=user, filepath=filepath, fit_id=state['fit_id'])
+    return labels
+
+
+def known_clusters(df: pd.DataFrame, user: str, filepath: str = './data') -> tuple:
+    """
+    Look up the clusters of the songs already clusterized (by spotify id) on the saved clusterization
+
+    Returns a tuple with a numpy array of the known clusters (None for the new songs) and a boolean numpy array
+        flagging the new songs. None if there is no saved clusterization
+    """
+
+    previous = load_user_results(filename='clusterization', user=user, filepath=filepath,
+                                 columns=['id', 'cluster'])
+    if previous is None:
+        return None
+
+    known = previous.drop_duplicates(subset='id').set_index('id')['cluster'].astype(str)
+    new = ~df['id'].isin(known.index).values
+    labels = np.array(df['id'].map(known), dtype=object)
+    labels[new] = None
+    return labels, new
+
+
+def save_cluster_model(scaler: MinMaxScaler, features: list, centroids: np.ndarray, user: str,
+                       filepath: str = './data', fit_id: str = None) -> None:
+    """
+    Save the cluster model artifact (clusterization_model.pkl): the fitted scaler, the feature columns and the centroids
+    It is all that is needed to assign new songs to the clusters, without fitting again
+    The fit id identifies the fit the centroids come from (a new one if None): the streaming state is only reused
+        while it matches, so the saved cluster numbers never mix two different fits
+    """
+
+    save_model(filename='clusterization_model',
+               model={'scaler': scaler,
+                      'features': list(features),
+                      'centroids': np.asarray(centroids),
+                      'clusters': len(centroids),
+                      'fit_id': uuid.uuid4().hex if fit_id is None else fit_id,
+                      'fitted_at': int(time.time())},
+               filepath=f'{filepath}/users/{user}')
+
+
+def nearest_centroid(X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Vectorized nearest centroid: squared euclidean distances as |x|^2 - 2 x.c + |c|^2, computed with a single matrix product
+
+    Returns a numpy array with the position of the nearest centroid of each row
+    """
+
+    distances = (X ** 2).sum(axis=1)[:, np.newaxis] - 2 * X @ centroids.T + (centroids ** 2).sum(axis=1)
+    return distances.argmin(axis=1)
+
+
+def assign_clusters(df: pd.DataFrame, user: str, filepath: str = './data') -> np.ndarray:
+    """
+    Assign the songs not clusterized yet to the nearest centroid of the saved cluster model (no fit)
+    The songs already clusterized keep their clusters
+
+    Returns a numpy array with the cluster of each track
+    """
+
+    artifact = load_model(filename='clusterization_model', filepath=f'{filepath}/users/{user}')
+    if artifact is None:
+        raise Exception('No cluster model saved. Run the clusterization with a number of clusters first')
+
+    known = known_clusters(df=df, user=user, filepath=filepath)
+    if known is None:
+        labels, new = np.full(len(df), None, dtype=object), np.ones(len(df), dtype=bool)
+    else:
+        labels, new = known
+
+    start = time.perf_counter()
+    if new.any():
+        X = artifact['scaler'].transform(df.loc[new, artifact['features']])
+        labels[new] = nearest_centroid(X, artifact['centroids']).astype(str)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    print(f"{new.sum()} new songs assigned to the {artifact['clusters']} clusters in {elapsed:.1f}ms "
+          f"({len(df) - new.sum()} already clusterized)")
+    return labels
+
+
+def save_clusters(df: pd.DataFrame, labels: np.ndarray, user: str, filepath: str = './data') -> pd.DataFrame:
+    """
+    Save the tracks with their clusters on the user folder
+
+    Returns the saved dataframe
+    """
+
+    df = df.assign(cluster=labels)
     df['cluster'] = df['cluster'].apply(str)
-    df.drop(columns=['no_id'], axis=1, inplace=True)
+    df = df.drop(columns=['no_id'])
 
     save_results(filename='clusterization',
                  df=df,
-                 filepath=f'./data/users/{user}')
+                 filepath=f'{filepath}/users/{user}')
+    return df
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+    user = os.environ.get("LASTFM_USER")
+
+    warnings.filterwarnings("ignore")
+    args = parse_args()
+
+    played, catalog, ids = load_data(user=user)
+    df = join_data(played=played, catalog=catalog, ids=ids)
+    df = dedupe_data(df)
+
+    if args['auto_k']:
+        # The silhouette score needs at least one song more than clusters
+        if args['k_range'][1] >= len(df):
+            raise Exception(f"Only {len(df)} songs to clusterize: the maximum of --k_range must be lower than that")
+        X, _ = scale_features(df)
+        args['clusters'], scores = choose_k(X=X,
+                                            k_range=args['k_range'],
+                                            sample_size=args['sample_size'],
+                                            random_state=args['random_state'],
+                                            algorithm=args['algorithm'],
+                                            sample_weight=df['play_count'].values if args['weighted'] else None,
+                                            jobs=args['jobs'])
+        save_results(filename='clusterization_k_scores',
+                     df=scores,
+                     filepath=f'./data/users/{user}')
+        print(scores.round(4).to_string(index=False))
+        print(f"{args['clusters']} clusters chosen")
+
+    if args['assign']:
+        labels = assign_clusters(df=df, user=user)
+    elif args['streaming']:
+        labels = stream_clusters(df=df,
+                                 clusters=args['clusters'],
+                                 user=user,
+                                 random_state=args['random_state'],
+                                 batch_size=args['batch_size'],
+                                 full_refit=args['full_refit'],
+                                 weighted=args['weighted'])
+    else:
+        X, scaler = scale_features(df)
+        kmeans = fit_clusters(X=X,
+                              clusters=args['clusters'],
+                              random_state=args['random_state'],
+                              algorithm=args['algorithm'],
+                              sample_weight=df['play_count'].values if args['weighted'] else None)
+        labels = kmeans.labels_
+        save_cluster_model(scaler=scaler, features=feature_columns(df), centroids=kmeans.cluster_centers_,
+                           user=user)
+    save_clusters(df=df, labels=labels, user=user)
 
     print("Clusterization done!")
@@ -1,16 +1,17 @@
-import json
-from math import ceil
 import os
 
 import argparse
-import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 
 from utils.utils import *
 from utils.spotify_api import spotify_user_api
-
-from icecream import ic
+from utils.progress import progress_reporter
+from utils.concurrency import rate_limiter, fetch_ordered, fetch_as_completed, controller
+from utils.http_client import configure_client
+from utils.credentials import credential_cache
+from utils.catalog import track_uris
+from utils.sampling import STRATEGIES, sampling_weights, sample_clusters
 
 
 def parse_args():
@@ -25,9 +26,107 @@ def parse_args():
                         help='If declared, it will update the previously created playlists instead of creating new ones')
     parser.add_argument('-l', '--lenght', nargs='?', default=150, type=int,
                         help='Total number of songs per playlist. Default is 150')
+    parser.add_argument('--replace_ratio', default=0.5, type=float,
+                        help='Share of changed songs from which a replaced playlist is rewritten at once instead of synced by differences. Default is 0.5')
+    parser.add_argument('--weights', default='uniform', type=str, choices=STRATEGIES,
+                        help='How the songs of each cluster are sampled: uniform, play_count (most played songs are more likely), recency (recently played songs are more likely) or centroid (songs closer to the cluster centroid are more likely). Default is uniform')
+    parser.add_argument('--half_life', default=90, type=float,
+                        help='Days for a song to lose half of its weight on the recency sampling. Default is 90')
+    parser.add_argument('--random_state', default=None, type=int,
+                        help='Seed of the songs sampling. Default is a different sample on every run')
+    parser.add_argument('-w', '--workers', default=4, type=int,
+                        help='Number of playlists created and written concurrently. Default is 4')
+    parser.add_argument('--rate', default=10, type=float,
+                        help='Maximum number of playlist requests per second, shared by all workers. Default is 10')
     return vars(parser.parse_args())
 
 
+def create_playlists(spotify: spotify_user_api, clusters: list, workers: int = 4) -> dict:
+    """
+    Create one empty playlist per cluster, concurrently
+
+    Returns a dict with the cluster number as key and the new playlist id as value
+    """
+
+    playlists = fetch_ordered(func=lambda cluster: spotify.create_playlist(
+        name=f'k-means-cluster-{cluster}', description='k-means generated playlist from lastfm data'),
+        items=clusters,
+        workers=workers)
+    return dict(zip(clusters, playlists))
+
+
+def cached_songs(playlists_df: pd.DataFrame) -> dict:
+    """
+    Read the snapshot id and the songs last written of each stored playlist (datasets saved before them have none)
+
+    Returns a dict with the cluster number as key and a (snapshot id, list of song uris) tuple as value
+    """
+
+    if 'snapshot_id' not in playlists_df.columns or 'tracks' not in playlists_df.columns:
+        return {}
+
+    cached = {}
+    for key, snapshot_id, tracks in zip(playlists_df.index, playlists_df['snapshot_id'], playlists_df['tracks']):
+        if isinstance(snapshot_id, str):
+            cached[key] = (snapshot_id, track_uris(tracks.split(',')) if isinstance(tracks, str) and tracks else [])
+    return cached
+
+
+def playlists_frame(playlists: dict, snapshots: dict = None, written: dict = None) -> pd.DataFrame:
+    """
+    Build the playlists dataset: one row per cluster (the row number is the cluster number) with the playlist id,
+        its snapshot id and the song ids last written on it (comma separated)
+
+    Returns the playlists dataframe
+    """
+
+    snapshots = {} if snapshots is None else snapshots
+    written = {} if written is None else written
+    keys = sorted(playlists)
+    return pd.DataFrame({'playlist_id': [playlists[key] for key in keys],
+                         'snapshot_id': [snapshots.get(key) for key in keys],
+                         'tracks': [','.join(uri.split(':')[-1] for uri in written[key]) if key in written else None
+                                    for key in keys]})
+
+
+def write_playlist(spotify: spotify_user_api, playlist: str, songs: list, replace: bool = False,
+                   new: bool = False, replace_ratio: float = 0.5, cached: tuple = None) -> dict:
+    """
+    Write the songs of a single playlist. The requests of a playlist run one after the other, so its songs keep their order
+    If replace, the playlist is synced by differences with its current songs (new playlists are empty, so they are not read)
+    If the playlist snapshot id is still the cached one, nothing changed it since the last run:
+        the cached songs are used instead of reading the playlist, and if the new songs are the same nothing is written
+
+    Returns a dict with the write requests made, the ones a full rewrite would make, the playlist snapshot id,
+        the playlist songs and if the cached songs were used
+    """
+
+    if replace is True:
+        current, snapshot_id = [] if new else None, None
+        if not new:
+            snapshot_id = spotify.get_playlist_snapshot(playlist=playlist)
+            if cached is not None and cached[0] == snapshot_id:
+                current = cached[1]
+
+        result = spotify.sync_playlist(playlist=playlist,
+                                       songs=songs,
+                                       current=current,
+                                       replace_ratio=replace_ratio)
+        result['cached'] = not new and current is not None
+        if result['snapshot_id'] is None:
+            result['snapshot_id'] = snapshot_id
+        return result
+
+    # Break the ids in chunks respecting the api limitation of batches of 100s
+    snapshot_id = None
+    chunks = [songs[i:i + 100] for i in range(0, len(songs), 100)]
+    for i in range(len(chunks)):
+        snapshot_id = spotify.add_song_to_playlist(songs=chunks[i],
+                                                   playlist=playlist)
+    return {'playlist': playlist, 'calls': len(chunks), 'full_rewrite_calls': len(chunks),
+            'snapshot_id': snapshot_id, 'songs': songs, 'cached': False}
+
+
 if __name__ == "__main__":
 
     # Get all env variables
@@ -35,44 +134,63 @@ if __name__ == "__main__":
     spotify_client_secret = os.environ.get("SPOTIFY_CLIENT_SECRET")
     spotify_client_id = os.environ.get("SPOTIFY_CLIENT_ID")
     user = os.environ.get("LASTFM_USER")
+    # The refresh token can be kept outside the project folder (e.g. out of a docker build context)
+    credentials_path = os.environ.get("SPOTIFY_CREDENTIALS_PATH", './cache')
 
     args = parse_args()
 
+    # Playlists are independent: they are written concurrently, all workers sharing the same request rate
+    configure_client(pool_size=args['workers'])
+    controller.resize(max_concurrency=args['workers'])
+
     # Start the spotify user api session and authenticate
     spotify = spotify_user_api(client_id=spotify_client_id,
                                client_secret=spotify_client_secret,
                                redirect_uri='https://www.google.com',
-                               scope='playlist-modify-public user-read-private')
+                               scope='playlist-modify-public user-read-private',
+                               credentials=credential_cache(filename='spotify_credentials',
+                                                            filepath=credentials_path),
+                               limiter=rate_limiter(rate=args['rate']))
     print(spotify)
 
-    df = load_user_results(filename='clusterization', user=user)
-    df = df[['cluster', 'id']]
+    # Only the columns used by the sampling strategy are loaded
+    model = None
+    columns = ['cluster', 'id']
+    if args['weights'] == 'play_count':
+        columns.append('play_count')
+    elif args['weights'] == 'recency':
+        columns.append('last_played')
+    elif args['weights'] == 'centroid':
+        model = load_model(filename='clusterization_model', filepath=f'./data/users/{user}')
+        columns += [] if model is None else model['features']
+    df = load_user_results(filename='clusterization', user=user, columns=columns)
+    # Clusters are stored as strings: the playlists are keyed by the cluster number
+    df['cluster'] = df['cluster'].astype(int)
 
     clusters = len(df['cluster'].unique())
 
+    # Playlists created on this run are empty, so they do not need to be read before syncing them
+    new_playlists = set()
+
     if args['replace_playlists'] is True:
         playlists_df = load_user_results(filename='playlists', user=user)
 
-        # Delete all songs from the existing playlists
-        for i in range(len(playlists_df.values)):
-            spotify.delete_playlist_songs(playlist=playlists_df.values[i][0],
-                                          songs=True)
-
         #playlists = playlists_df.reset_index()['playlist_id'].to_dict()
         playlists = playlists_df.to_dict()
         playlists = playlists['playlist_id']
+        # Snapshot ids and songs written on the last run
+        cached = cached_songs(playlists_df)
         # Create new playlists if needed (more clusters than spotify ids already stored)
         if len(playlists_df.index) < clusters:
-            new = clusters - len(playlists_df.index)
+            new = list(range(len(playlists_df.index), clusters))
+            playlists.update(create_playlists(spotify=spotify,
+                                              clusters=new,
+                                              workers=args['workers']))
+            new_playlists.update(new)
 
-            for i in range(new):
-                cluster = len(playlists_df.index) + i
-                playlist = spotify.create_playlist(
-                    name=f'k-means-cluster-{cluster}', description='k-means generated playlist from lastfm data')
-                playlists[cluster] = playlist
-
-            playlists_df = pd.DataFrame(data=playlists.values(),
-                                        columns=['playlist_id'])
+            playlists_df = playlists_frame(playlists=playlists,
+                                           snapshots={key: cached[key][0] for key in cached},
+                                           written={key: cached[key][1] for key in cached})
             save_results(filename='playlists',
                          df=playlists_df,
                          filepath=f'./data/users/{user}')
@@ -82,31 +200,64 @@ if __name__ == "__main__":
 
     else:
         # Create new playlists from scratch
-        playlists = {}
-        for i in range(clusters):
-            cluster = df['cluster'].unique()[i].item()
-            playlist = spotify.create_playlist(
-                name=f'k-means-cluster-{cluster}', description='k-means generated playlist from lastfm data')
-
-            # Generate a dict with the clusters and the playlist id - this will be used to add the songs later
-            playlists[cluster] = playlist
+        # Generate a dict with the clusters and the playlist id - this will be used to add the songs later
+        playlists = create_playlists(spotify=spotify,
+                                     clusters=[int(cluster) for cluster in df['cluster'].unique()],
+                                     workers=args['workers'])
+        new_playlists.update(playlists)
+        cached = {}
 
-        playlists_df = pd.DataFrame(data=playlists.values(),
-                                    columns=['playlist_id'])
+        playlists_df = playlists_frame(playlists=playlists)
         save_results(filename='playlists',
                      df=playlists_df,
                      filepath=f'./data/users/{user}')
 
+    # Songs of each playlist, sampled before any request is made
+    # All clusters are sampled at once (clusters with less songs than lenght are taken whole)
+    samples = sample_clusters(clusters=df['cluster'].to_numpy(),
+                              n=args['lenght'],
+                              weights=sampling_weights(df=df,
+                                                       strategy=args['weights'],
+                                                       half_life=args['half_life'],
+                                                       model=model),
+                              random_state=args['random_state'])
+    ids = df['id'].to_numpy()
+    # Stored playlists without a cluster anymore are left empty
+    songs = {key: track_uris(ids[samples[key]]) if key in samples else [] for key in playlists}
+
     # Adding songs to the playlists
-    ic(playlists)
-    for key in playlists:
-        ic(key)
-        tempdf = df[df['cluster'] == key].sample(n=args['lenght'])
-        # Break the ids in chunks respecting the api limitation of batches of 100s
-        splits = ceil(len(tempdf)/100)
-        chunks = np.array_split(tempdf, splits)
-        for i in range(len(chunks)):
-            spotify.add_song_to_playlist(songs=chunks[i]['id'].tolist(),
-                                         playlist=playlists[key])
+    progress = progress_reporter(description='Playlists',
+                                 total=len(playlists),
+                                 controller=controller)
+    calls, full_rewrite_calls = 0, 0
+    results = fetch_as_completed(func=lambda key: write_playlist(spotify=spotify,
+                                                                 playlist=playlists[key],
+                                                                 songs=songs[key],
+                                                                 replace=args['replace_playlists'],
+                                                                 new=key in new_playlists,
+                                                                 replace_ratio=args['replace_ratio'],
+                                                                 cached=cached.get(key)),
+                                 items=list(playlists),
+                                 workers=args['workers'])
+    snapshots, written, reads_skipped, writes_skipped = {}, {}, 0, 0
+    for key, result in results:
+        calls += result['calls']
+        full_rewrite_calls += result['full_rewrite_calls']
+        snapshots[key] = result['snapshot_id']
+        written[key] = result['songs']
+        reads_skipped += result['cached']
+        writes_skipped += result['cached'] and result['calls'] == 0
+        progress.update()
+
+    progress.close()
 
+    # The snapshot ids let the next run skip reading the playlists nobody changed in the meantime
+    save_results(filename='playlists',
+                 df=playlists_frame(playlists=playlists, snapshots=snapshots, written=written),
+                 filepath=f'./data/users/{user}')
+
+    if args['replace_playlists'] is True:
+        print(f"Playlists synced with {calls} write requests "
+              f"({full_rewrite_calls - calls} saved compared with deleting and adding all the songs)")
+        print(f"{reads_skipped} playlists unchanged since the last run were not read, {writes_skipped} of them were not written")
     print("Playlists created on Spotify!")
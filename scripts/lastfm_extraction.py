@@ -1,15 +1,17 @@
 import os
-import sys
 import time
-import requests as re
 import warnings
 from datetime import datetime
 
 import argparse
-import pandas as pd
 from dotenv import load_dotenv
 
-from utils.utils import save_results, load_user_results
+from utils.utils import user_partitions_path
+from utils.scrobble_store import upsert_scrobbles, max_timestamp, remove_scrobbles
+from utils.concurrency import rate_limiter, fetch_ordered
+from utils.checkpoints import page_journal, list_journals
+from utils.progress import progress_reporter
+from utils.http_client import get_client, configure_client
 
 
 def parse_args():
@@ -22,14 +24,23 @@ def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('start', type=str,
                         help='Start date on YYYYMMDD format')
+    parser.add_argument('-c', '--concurrent', action='store_true',
+                        help='If declared, all pages after the first one will be requested concurrently')
+    parser.add_argument('-w', '--workers', default=4, type=int,
+                        help='Number of concurrent requests on the concurrent mode. Default is 4')
+    parser.add_argument('--rate', default=5, type=float,
+                        help='Maximum number of requests per second on the concurrent mode. Default is 5 (Last.fm api limit)')
+    parser.add_argument('--merge_pages', default=50, type=int,
+                        help='Number of checkpointed pages merged into the stored data at a time. Default is 50')
     return vars(parser.parse_args())
 
 
-def append_results(response):
+def append_results(response, responses):
     """
     Iteration fuction to work on each request page.
     The input is the json from the API request,
-        Append the results to a final responses list with all the data necessary
+        Append the results to the responses list with all the data necessary
+        Tracks currently being played are flagged, so they can be replaced on the next extraction
 
     Returns None
     """
@@ -39,25 +50,26 @@ def append_results(response):
         if '@attr' in response[i]:
             if response[i]['@attr']['nowplaying'] == 'true':
                 r = [response[i]['artist']['#text'], response[i]['name'],
-                     int(time.mktime(datetime.now().timetuple()))]
+                     int(time.mktime(datetime.now().timetuple())), True]
                 responses.append(r)
         else:
             r = [response[i]['artist']['#text'], response[i]
-                 ['name'], response[i]['date']['uts']]
+                 ['name'], int(response[i]['date']['uts']), False]
             responses.append(r)
 
 
-def get_lastfm_tracks(from_date, api_key, user, page=1):
+def get_lastfm_tracks(from_date, api_key, user, page=1, to_date=None):
     """
     Makes the api request on the lastfm api to reurn a specific page of the last played tracks
         If no pagination value is passed, it will make the request for the first page
+        If to_date is passed, scrobbles after it are left out, so the pagination does not shift while new tracks are played
 
     If anything wrong happens on the request, it will print the error status_code and stop the script execution
 
     Returns the played tracks from said page a json format
     """
 
-    response = re.get(
+    response = get_client().get(
         url='http://ws.audioscrobbler.com/2.0/',
         headers={'user-agent': 'my_played_tracks'},
         params={
@@ -68,6 +80,7 @@ def get_lastfm_tracks(from_date, api_key, user, page=1):
             'user': user,
             'extended': 0,
             'from': from_date,
+            'to': to_date,
             'page': page
         }
     )
@@ -87,19 +100,34 @@ if __name__ == "__main__":
 
     args = parse_args()
 
-    stored_data = load_user_results(filename='lastfm_played_tracks',
-                                    user=user)
+    # Keep one pooled connection per concurrent worker
+    configure_client(pool_size=args['workers'] if args['concurrent'] else 1)
+
+    played_path = user_partitions_path(filename='lastfm_played_tracks',
+                                       user=user)
 
     from_date = int(time.mktime(
         datetime.strptime(args['start'], '%Y%m%d').date().timetuple()))
 
-    if stored_data is None:
+    # A run interrupted while merging its pages leaves a complete journal behind, and the next run starts from
+    # another date (the newest merged scrobble), so it would never be resumed: its pages are merged first
+    checkpoints_path = f'./data/users/{user}/checkpoints'
+    journal_columns = ['artist', 'song', 'unix_timestamp', 'nowplaying']
+    for stale in list_journals(filepath=checkpoints_path, columns=journal_columns):
+        if stale.is_complete():
+            print(f"Merging the pages left by a previous extraction from {stale.from_date}")
+            for responses_df in stale.batches(pages=args['merge_pages'], reverse=True):
+                upsert_scrobbles(df=responses_df, filepath=played_path)
+            stale.clear()
+
+    # Only the newest partition is read to find where the last extraction stopped
+    max_date = max_timestamp(filepath=played_path)
+
+    if max_date is None:
         # No stored data. No need to update the from date: make requests from the start date argument
         pass
     else:
         # If there is stored data, we need to compare the dates and update the from_date, if needed
-        max_date = stored_data['unix_timestamp'].max().item()
-
         if max_date > from_date:
             from_date = max_date
         elif max_date == from_date:
@@ -113,47 +141,80 @@ if __name__ == "__main__":
                 f"Current maximum stored date is {datetime.utcfromtimestamp(max_date).strftime('%Y-%m-%d %H:%M:%S')}")
             print("If you want to cancel, exit the program now!!!")
             time.sleep(5)
-            stored_data = None
-
-    responses = []
-
-    response = get_lastfm_tracks(
-        from_date=from_date, api_key=api_key, user=user)
-
-    append_results(response['track'])
-
-    time.sleep(0.2)
+            remove_scrobbles(filepath=played_path)
+
+    # Incomplete journals of other start dates can not be resumed anymore, and merging them would leave a gap
+    # in between their pages: they are removed
+    for stale in list_journals(filepath=checkpoints_path, columns=journal_columns):
+        if stale.from_date != from_date:
+            print(f"Removing the incomplete pages of a previous extraction from {stale.from_date}")
+            stale.clear()
+
+    # Every fetched page is checkpointed, so a failed extraction can be resumed with the same arguments
+    journal = page_journal(filepath=checkpoints_path,
+                           from_date=from_date,
+                           columns=journal_columns)
+
+    def fetch_page(page):
+        response = get_lastfm_tracks(from_date=from_date, api_key=api_key, user=user,
+                                     page=page, to_date=journal.meta['to_date'])
+        rows = []
+        append_results(response['track'], rows)
+        journal.save_page(page=page, rows=rows)
+        return response
+
+    start_time = time.monotonic()
+
+    if 'to_date' not in journal.meta:
+        journal.save_meta(to_date=int(time.time()))
+
+    if 'total_pages' in journal.meta:
+        print(f"Resuming extraction: {len(journal.saved_pages())} pages already checkpointed")
+    else:
+        response = fetch_page(page=1)
+        journal.save_meta(total_pages=int(response['@attr']['totalPages']))
+        time.sleep(0.2)
 
-    total_pages = int(response['@attr']['totalPages'])
-    page = int(response['@attr']['page']) + 1
+    total_pages = journal.meta['total_pages']
+    missing_pages = journal.missing_pages(total_pages=total_pages)
 
-    # Loop through all other pages
-    while page <= total_pages:
-        os.system('clear')
-        print("requesting page", page, "from", total_pages, "pages")
+    progress = progress_reporter(description='Last.fm pages',
+                                 total=len(missing_pages))
 
-        response = get_lastfm_tracks(
-            from_date=from_date, api_key=api_key, user=user, page=page)
+    if args['concurrent']:
+        # Request all the remaining pages at once, sharing a rate limiter to respect the api limits
+        limiter = rate_limiter(rate=args['rate'])
+        pages = fetch_ordered(func=fetch_page,
+                              items=missing_pages,
+                              workers=args['workers'],
+                              limiter=limiter)
 
-        append_results(response['track'])
+        for response in pages:
+            progress.update()
 
-        time.sleep(0.2)
+    else:
+        # Loop through all other pages
+        for page in missing_pages:
+            fetch_page(page=page)
+            progress.update()
 
-        page = int(response['@attr']['page']) + 1
+            time.sleep(0.2)
 
-    # Save results on a csv file
-    print(f'Saving csv results on data/users/{user}/lastfm_played_tracks.csv')
+    progress.close()
+    elapsed = time.monotonic() - start_time
+    print(f"{total_pages} pages available, extraction took {elapsed:.1f}s")
 
-    responses_df = pd.DataFrame(data=responses, columns=[
-        'artist', 'song', 'unix_timestamp'])
+    # Merge the checkpointed pages into the month partitions, a few pages at a time
+    # Pages are merged from the oldest to the newest, so if the merge is interrupted the next run restarts from the right date
+    # Only the months with new scrobbles are rewritten
+    print(f'Saving results on {played_path}')
 
-    if stored_data is None:
-        pass
-    else:
-        responses_df = responses_df.append(stored_data, ignore_index=True)
+    partitions = set()
+    for responses_df in journal.batches(pages=args['merge_pages'], reverse=True):
+        partitions.update(upsert_scrobbles(
+            df=responses_df, filepath=played_path))
+    print(f'{len(partitions)} partitions updated')
 
-    save_results(filename='lastfm_played_tracks',
-                 df=responses_df,
-                 filepath=f'./data/users/{user}')
+    journal.clear()
 
     print('All good! Played tracks extracted from Lastfm')
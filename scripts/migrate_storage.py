@@ -0,0 +1,79 @@
+import pathlib
+
+import argparse
+from dotenv import load_dotenv
+
+from utils.utils import save_results, load_results, user_partitions_path, PARTITIONED, RETIRED
+from utils.storage import SCHEMAS, get_backend
+
+
+def parse_args():
+    """
+    Parse arguments passed when calling the scripts
+
+    Returns a dict with all the arguments
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--source', default='csv', type=str,
+                        help='Storage backend the data is currently stored on. Default is csv')
+    parser.add_argument('-t', '--target', default=None, type=str,
+                        help='Storage backend the data should be converted to. Default is the STORAGE_BACKEND env variable')
+    parser.add_argument('-p', '--path', default='./data', type=str,
+                        help='Data folder to be converted. Default is ./data')
+    parser.add_argument('--remove', action='store_true',
+                        help='If declared, the source files are removed after the conversion')
+    return vars(parser.parse_args())
+
+
+def data_folders(filepath: str) -> list:
+    """
+    All folders with stored datasets: the shared data folder and each user folder
+
+    Returns a list with the folder paths
+    """
+
+    folders = [filepath]
+    users_path = pathlib.Path(filepath) / 'users'
+    if users_path.is_dir():
+        folders += [filepath + '/users/' + user.name
+                    for user in sorted(users_path.iterdir()) if user.is_dir()]
+    return folders
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+    args = parse_args()
+
+    source = get_backend(args['source'])
+    target = get_backend(args['target'])
+
+    if source is target:
+        raise ValueError(
+            f"Source and target storage backends are the same ({source.name})")
+
+    for folder in data_folders(args['path']):
+        # Played tracks are stored on month partitions, whatever backend is chosen
+        if folder != args['path']:
+            user = pathlib.Path(folder).name
+            for filename in PARTITIONED:
+                user_partitions_path(filename=filename,
+                                     user=user,
+                                     filepath=args['path'])
+
+        for filename in SCHEMAS:
+            # Retired datasets are left where they are, to be imported by their new storage
+            if filename in PARTITIONED or filename in RETIRED or not source.exists(filename=filename, filepath=folder):
+                continue
+
+            print(f"Converting {folder}/{filename} from {source.name} to {target.name}")
+            df = load_results(filename=filename,
+                              filepath=folder, backend=source.name)
+            save_results(filename=filename, df=df,
+                         filepath=folder, backend=target.name)
+
+            if args['remove'] and hasattr(source, 'path'):
+                source.path(filename=filename, filepath=folder).unlink()
+
+    print(f"Done! Remember to set STORAGE_BACKEND = \"{target.name}\" on the .env file")
@@ -1,13 +1,38 @@
 import os
 import sys
 import warnings
+from math import ceil
 
-# import argparse
+import argparse
 import pandas as pd
 from dotenv import load_dotenv
 
 from utils.utils import *
 from utils.spotify_api import spotify_requests
+from utils.track_index import track_index
+from utils.catalog import track_catalog
+from utils.concurrency import rate_limiter, controller
+from utils.progress import progress_reporter
+from utils.http_client import configure_client
+
+
+def parse_args():
+    """
+    Parse arguments passed when calling the scripts
+
+    Returns a dict with all the arguments
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--workers', default=8, type=int,
+                        help='Number of concurrent spotify searches. Default is 8')
+    parser.add_argument('--rate', default=20, type=float,
+                        help='Maximum number of spotify searches per second. Default is 20')
+    parser.add_argument('--save_every', default=500, type=int,
+                        help='Number of found ids saved at a time on the tracks index. Default is 500')
+    parser.add_argument('--not_found_ttl', default=30, type=float,
+                        help='Days a not found song (or a song without features) is kept before being searched again. Default is 30')
+    return vars(parser.parse_args())
 
 
 if __name__ == "__main__":
@@ -18,59 +43,86 @@ if __name__ == "__main__":
     spotify_client_id = os.environ.get("SPOTIFY_CLIENT_ID")
     user = os.environ.get("LASTFM_USER")
 
-    tracks = load_user_results(filename='lastfm_played_tracks', user=user)
-    tracks.drop(tracks.columns[2], axis=1, inplace=True)
-    tracks = tracks.drop_duplicates()
-
-    stored_tracks_ids = load_results(filename='spotify_tracks_ids')
-    if stored_tracks_ids is not None:
-        # To ensure we are only making api calls for non-stored data
-        tracks = pd.merge(left=tracks,
-                          right=stored_tracks_ids,
-                          how='outer',
-                          left_on=['song', 'artist'],
-                          right_on=['song', 'artist'],
-                          indicator=True)
-        tracks = tracks[tracks['_merge'] == 'left_only']
-        tracks = tracks.drop(columns='_merge', axis=1)
-
-    else:
-        pass
+    args = parse_args()
+
+    # Keep one pooled connection per concurrent worker
+    configure_client(pool_size=args['workers'])
+    controller.resize(max_concurrency=args['workers'])
+
+    played = load_user_results(filename='lastfm_played_tracks', user=user,
+                               columns=['artist', 'song'])
+    played = played.drop_duplicates()
+
+    # To ensure we are only making api calls for non-stored data
+    tracks_index = track_index(not_found_ttl=int(args['not_found_ttl'] * 24 * 3600))
+    tracks = tracks_index.missing(played)
+
+    # Spelling variants of already searched songs are resolved locally
+    resolved, tracks = tracks_index.resolve_aliases(tracks)
+    tracks_index.upsert(resolved)
+    print(f"{len(resolved)} songs resolved from known aliases, {len(tracks)} songs to be searched")
 
     # Spotify API  - Get Song IDs
     spotify = spotify_requests(client_id=spotify_client_id,
                                client_secret=spotify_client_secret)
 
-    # Start the api calls and save the spotify song id on a new columns of the dataframe
-    print("Retrieving spotify ids for a few songs")
-    tracks['sp_id'] = tracks.apply(lambda x: spotify.find_song_id(
-        song_name=x['song'], band_name=x['artist']), axis=1)
+    # Start the concurrent api calls and save the spotify song ids on the index as they are found
+    progress = progress_reporter(description='Spotify id searches',
+                                 total=len(tracks),
+                                 controller=controller)
+    found = []
+    for artist, song, sp_id in spotify.find_songs_ids(tracks=tracks,
+                                                      workers=args['workers'],
+                                                      limiter=rate_limiter(rate=args['rate'])):
+        found.append([artist, song, sp_id, sp_id == 'not_found'])
+        progress.update()
 
-    # Creating a boolean column for not found song ids
-    tracks['no_id'] = tracks['sp_id'].apply(lambda x: x == 'not_found')
+        if len(found) >= args['save_every']:
+            tracks_index.upsert(pd.DataFrame(data=found,
+                                             columns=['artist', 'song', 'sp_id', 'no_id']))
+            found = []
 
-    if stored_tracks_ids is not None:
-        tracks = tracks.append(stored_tracks_ids)
+    tracks_index.upsert(pd.DataFrame(data=found,
+                                     columns=['artist', 'song', 'sp_id', 'no_id']))
+    progress.close()
 
-    save_results(filename='spotify_tracks_ids', df=tracks)
+    tracks = tracks_index.lookup(played)
 
-    os.system('clear')
     found_ratio = round(
-        (len(tracks[tracks['sp_id'] != 'not_found'])/len(tracks)*100))
+        (len(tracks[tracks['sp_id'] != 'not_found'])/max(len(tracks), 1)*100))
+    print(f"Spotify ids found for {found_ratio}% of the played songs")
 
     print('\n Getting the song features...')
 
-    tracks = tracks[tracks['no_id'] == False]
-
-    # Create and empty DF to store the results
-    song_features = spotify.get_songs_features(ids=tracks['sp_id'])
-
-    # song_features.set_index('id', inplace=True)
-    stored_song_features = load_results(filename='spotify_songs_features')
-
-    if stored_song_features is not None:
-        song_features = song_features.append(stored_song_features)
-
-    save_results(filename='spotify_songs_features', df=song_features)
-
+    # Features are only requested for the ids not stored yet
+    resolved_ids = tracks.loc[tracks['no_id'] == False, 'sp_id'].drop_duplicates()
+    total_ids = len(resolved_ids)
+    # Only the stored ids are loaded (sorted bytes array), the lookup is a binary search
+    stored = track_catalog.load(feature_columns=[], tracks=False)
+    resolved_ids = resolved_ids[~stored.has_features(resolved_ids)]
+    del stored
+    # Ids that came back without features are only requested again once their result expires
+    no_features = tracks_index.without_features(resolved_ids)
+    resolved_ids = resolved_ids[~no_features.values]
+
+    progress = progress_reporter(description='Spotify features',
+                                 total=len(resolved_ids),
+                                 controller=controller)
+    song_features = spotify.get_songs_features(ids=resolved_ids,
+                                               progress=progress,
+                                               workers=args['workers'],
+                                               limiter=rate_limiter(rate=args['rate']))
+    progress.close()
+
+    tracks_index.upsert_without_features(
+        sorted(set(resolved_ids) - set(song_features['id'])))
+
+    avoided_calls = ceil(total_ids / 100) - ceil(len(resolved_ids) / 100)
+    print(f"{len(resolved_ids)} new song features requested ({avoided_calls} api calls avoided, "
+          f"{int(no_features.sum())} ids known to have no features skipped)")
+
+    upsert_results(filename='spotify_songs_features',
+                   df=song_features, key=['id'])
+
+    print(controller)
     print('Done! Spotify songs features and ids retrieved')
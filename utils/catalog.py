@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+
+from utils.utils import load_results
+from utils.track_index import track_index
+from utils.storage import FEATURES_DTYPES
+
+
+# Spotify ids are 22 ascii characters (base 62), so they fit on a fixed width bytes array
+ID_DTYPE = 'S22'
+# Song features kept on the catalog matrix. The type and url columns are derived from the id
+CATALOG_FEATURES = ['danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+                    'instrumentalness', 'liveness', 'valence', 'tempo', 'duration_ms', 'time_signature']
+
+
+def encode_ids(ids) -> np.ndarray:
+    """
+    Returns:
+        numpy array of fixed width bytes with the spotify ids (missing ids are empty)
+    """
+    if isinstance(ids, np.ndarray) and ids.dtype.kind == 'S':
+        return ids.astype(ID_DTYPE)
+    return np.asarray(pd.Series(ids, dtype=object).fillna('').astype(str).values.tolist(), dtype=ID_DTYPE)
+
+
+def decode_ids(ids: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        numpy array of python strings with the spotify ids
+    """
+    return np.char.decode(np.asarray(ids, dtype=ID_DTYPE), 'ascii').astype(object)
+
+
+def track_uris(ids) -> list:
+    """
+    Returns:
+        list with the spotify uris of the ids ("spotify:track:{id}")
+    """
+    return ['spotify:track:' + sp_id for sp_id in decode_ids(encode_ids(ids))]
+
+
+def track_hrefs(ids) -> list:
+    return ['https://api.spotify.com/v1/tracks/' + sp_id for sp_id in decode_ids(encode_ids(ids))]
+
+
+def analysis_urls(ids) -> list:
+    return ['https://api.spotify.com/v1/audio-analysis/' + sp_id for sp_id in decode_ids(encode_ids(ids))]
+
+
+class track_catalog(object):
+    """
+    Description:
+        Compact in-memory catalog of the tracks and their song features
+        Artist and song names are interned (integer codes pointing to a single copy of each name),
+            spotify ids are kept on fixed width bytes arrays and the song features on matrices sorted by id
+            (a float32 one and an int64 one for the integer features, e.g. duration_ms), so a feature lookup is a binary search.
+            Uri and url columns are computed on demand
+
+    Arguments:
+        tracks:
+            Dataframe with artist, song, sp_id and no_id columns (e.g. the track index). If None, the catalog has no tracks
+
+        features:
+            Dataframe with the id and song features columns. If None, the catalog has no features
+
+        feature_columns:
+            Song features kept on the matrix. Default is CATALOG_FEATURES
+    """
+
+    def __init__(self, tracks: pd.DataFrame = None, features: pd.DataFrame = None, feature_columns: list = None) -> object:
+        if tracks is None:
+            tracks = pd.DataFrame({'artist': [], 'song': [], 'sp_id': [], 'no_id': []})
+        artists = pd.Categorical(tracks['artist'])
+        songs = pd.Categorical(tracks['song'])
+        self.artists = artists.categories
+        self.artist_codes = artists.codes
+        self.songs = songs.categories
+        self.song_codes = songs.codes
+        self.no_id = np.asarray(tracks['no_id'], dtype=bool)
+        self.track_ids = encode_ids(pd.Series(np.asarray(tracks['sp_id'], dtype=object)).where(~self.no_id, ''))
+
+        self.feature_names = list(CATALOG_FEATURES if feature_columns is None else
+                                  [column for column in feature_columns if column != 'id'])
+        # Integer features are not stored on the float32 matrix, which is exact only up to 2 ** 24
+        self.int_names = [column for column in self.feature_names
+                          if not np.issubdtype(FEATURES_DTYPES.get(column, np.float32), np.floating)]
+        self.float_names = [column for column in self.feature_names if column not in self.int_names]
+        if features is None:
+            features = pd.DataFrame(columns=['id'] + self.feature_names)
+        features = features.drop_duplicates(subset='id', keep='last')
+        ids = encode_ids(features['id'])
+        # Sorted by id, so the lookups are binary searches
+        order = np.argsort(ids, kind='stable')
+        self.feature_ids = ids[order]
+        self.features = features[self.float_names].to_numpy(dtype=np.float32).reshape(
+            len(features), len(self.float_names))[order]
+        self.int_features = features[self.int_names].to_numpy(dtype=np.int64).reshape(
+            len(features), len(self.int_names))[order]
+
+    def __str__(self):
+        return (f"Track catalog with {len(self)} tracks ({len(self.artists)} artists) and {len(self.feature_ids)} song features, "
+                f"{self.memory_usage() / 1024 ** 2:.1f} MB")
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    @classmethod
+    def load(cls, filepath: str = './data', feature_columns: list = None, tracks: bool = True) -> 'track_catalog':
+        """
+        Description:
+            Build the catalog from the stored track index and song features
+
+        Arguments:
+            filepath(string) = './data':
+                The data folder
+
+            feature_columns(list) = None:
+                Song features to be loaded. Default is CATALOG_FEATURES. If empty, only the ids with features are loaded
+
+            tracks(bool) = True:
+                If the track index should be loaded
+
+        Returns:
+            track_catalog
+        """
+        feature_columns = CATALOG_FEATURES if feature_columns is None else feature_columns
+        features = load_results(filename='spotify_songs_features', filepath=filepath,
+                                columns=['id'] + [column for column in feature_columns if column != 'id'])
+        index = track_index(filepath=filepath).load() if tracks else None
+        return cls(tracks=index, features=features, feature_columns=feature_columns)
+
+    def feature_rows(self, ids) -> np.ndarray:
+        """
+        Returns:
+            numpy array with the position of each id on the features matrix (-1 if the id has no features)
+        """
+        ids = encode_ids(ids)
+        if len(self.feature_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.searchsorted(self.feature_ids, ids).clip(max=len(self.feature_ids) - 1)
+        return np.where(self.feature_ids[positions] == ids, positions, -1)
+
+    def has_features(self, ids) -> np.ndarray:
+        """
+        Returns:
+            boolean numpy array flagging the ids with song features on the catalog
+        """
+        return self.feature_rows(ids) >= 0
+
+    def features_frame(self, rows: np.ndarray = None, urls: bool = False) -> pd.DataFrame:
+        """
+        Description:
+            Song features of some rows of the matrix as a dataframe (with the dtypes of the stored dataset)
+
+        Arguments:
+            rows(np.ndarray) = None:
+                Positions on the features matrix (e.g. from feature_rows). If None, all rows
+
+            urls(bool) = False:
+                If the uri, track_href and analysis_url columns should be computed
+
+        Returns:
+            pd.DataFrame with the song features and the id columns
+        """
+        rows = np.arange(len(self.feature_ids)) if rows is None else np.asarray(rows)
+        df = pd.concat([pd.DataFrame(self.features[rows], columns=self.float_names),
+                        pd.DataFrame(self.int_features[rows], columns=self.int_names).astype(
+                            {column: FEATURES_DTYPES[column] for column in self.int_names})],
+                       axis=1)[self.feature_names]
+        df['id'] = decode_ids(self.feature_ids[rows])
+        if urls:
+            df['uri'] = track_uris(self.feature_ids[rows])
+            df['track_href'] = track_hrefs(self.feature_ids[rows])
+            df['analysis_url'] = analysis_urls(self.feature_ids[rows])
+        return df
+
+    def tracks_frame(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame with the artist and song (categorical columns), sp_id and no_id of the tracks
+        """
+        return pd.DataFrame({'artist': pd.Categorical.from_codes(self.artist_codes, categories=self.artists),
+                             'song': pd.Categorical.from_codes(self.song_codes, categories=self.songs),
+                             'sp_id': np.where(self.no_id, 'not_found', decode_ids(self.track_ids)),
+                             'no_id': self.no_id})
+
+    def memory_usage(self) -> int:
+        """
+        Returns:
+            int with the bytes used by the catalog arrays and the interned names
+        """
+        arrays = [self.artist_codes, self.song_codes, self.no_id, self.track_ids, self.feature_ids, self.features,
+                  self.int_features]
+        names = self.artists.memory_usage(deep=True) + self.songs.memory_usage(deep=True)
+        return sum(array.nbytes for array in arrays) + names
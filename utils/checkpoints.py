@@ -0,0 +1,165 @@
+import os
+import json
+import shutil
+import pathlib
+
+import pandas as pd
+
+
+class page_journal(object):
+    """
+    Description:
+        Checkpoint journal for paginated extractions.
+        Every fetched page is persisted on its own file, keyed by the extraction start date and the page number,
+            so a failed extraction can be resumed by requesting only the pages still missing
+
+    Arguments:
+        filepath:
+            Folder where the journals are stored
+
+        from_date:
+            Unix timestamp the extraction starts from. Each start date has its own journal
+
+        columns:
+            Columns of the rows stored for each page
+    """
+
+    def __init__(self, filepath: str, from_date: int, columns: list) -> object:
+        self.from_date = from_date
+        self.columns = columns
+        self.path = pathlib.Path(filepath) / str(from_date)
+        self.meta = self.load_meta()
+
+    def __str__(self):
+        return f"Page journal for extractions from {self.from_date} at {self.path}"
+
+    def load_meta(self) -> dict:
+        """
+        Description:
+            Load the journal metadata (e.g. the total number of pages) stored by a previous run
+
+        Returns:
+            dict with the metadata. Empty if the journal is new
+        """
+        meta_path = self.path / 'journal.json'
+        if not meta_path.is_file():
+            return {}
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def save_meta(self, **kwargs) -> None:
+        """
+        Description:
+            Store metadata that should be reused when the extraction is resumed
+
+        Returns:
+            None
+        """
+        self.meta.update(kwargs)
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / 'journal.json', 'w') as f:
+            json.dump(self.meta, f)
+
+    def page_path(self, page: int) -> pathlib.Path:
+        return self.path / f'page_{page:06d}.parquet'
+
+    def save_page(self, page: int, rows: list) -> None:
+        """
+        Description:
+            Persist the rows of a single page. The file is written on a temporary path and then moved,
+                so an interrupted write is never taken as a finished page.
+            Safe to be called from concurrent workers
+
+        Arguments:
+            page(int):
+                The page number
+
+            rows(list):
+                The page rows, following the journal columns
+
+        Returns:
+            None
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        temp_path = self.page_path(page).with_suffix('.tmp')
+        pd.DataFrame(data=rows, columns=self.columns).to_parquet(
+            temp_path, index=False)
+        os.replace(temp_path, self.page_path(page))
+
+    def saved_pages(self) -> list:
+        """
+        Returns:
+            Sorted list with the page numbers already persisted
+        """
+        if not self.path.is_dir():
+            return []
+        return sorted(int(path.stem.replace('page_', ''))
+                      for path in self.path.glob('page_*.parquet'))
+
+    def missing_pages(self, total_pages: int) -> list:
+        """
+        Returns:
+            Sorted list with the page numbers (from 1 to total_pages) not persisted yet
+        """
+        saved = set(self.saved_pages())
+        return [page for page in range(1, total_pages + 1) if page not in saved]
+
+    def is_complete(self) -> bool:
+        """
+        Returns:
+            bool, True if all the pages of the extraction were persisted
+        """
+        return 'total_pages' in self.meta and not self.missing_pages(total_pages=self.meta['total_pages'])
+
+    def batches(self, pages: int = 50, reverse: bool = False):
+        """
+        Description:
+            Read the persisted pages back, a few at a time, so memory does not grow with the extraction size
+
+        Arguments:
+            pages(int) = 50:
+                Number of pages on each batch
+
+            reverse(bool) = False:
+                If True, the pages are read from the last to the first one
+
+        Returns:
+            Generator of dataframes, each with the rows of up to `pages` pages
+        """
+        saved = sorted(self.saved_pages(), reverse=reverse)
+        for i in range(0, len(saved), pages):
+            frames = [pd.read_parquet(self.page_path(page))
+                      for page in saved[i:i + pages]]
+            yield pd.concat(frames, ignore_index=True)
+
+    def clear(self) -> None:
+        """
+        Description:
+            Remove the journal after its pages were merged
+        """
+        if self.path.is_dir():
+            shutil.rmtree(self.path)
+        self.meta = {}
+
+
+def list_journals(filepath: str, columns: list) -> list:
+    """
+    Description:
+        All the journals stored on a folder, one per extraction start date
+
+    Arguments:
+        filepath(string):
+            Folder where the journals are stored
+
+        columns(list):
+            Columns of the rows stored for each page
+
+    Returns:
+        list of page_journal, sorted by start date
+    """
+    path = pathlib.Path(filepath)
+    if not path.is_dir():
+        return []
+    return [page_journal(filepath=filepath, from_date=int(folder.name), columns=columns)
+            for folder in sorted(path.iterdir(), key=lambda folder: folder.name.zfill(20))
+            if folder.is_dir() and folder.name.isdigit()]
@@ -0,0 +1,316 @@
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+
+class rate_limiter(object):
+    """
+    Description:
+        Thread safe rate limiter to be shared in between concurrent workers.
+        Every call to wait() books the next free slot, so no more than `rate` requests are started per second
+            no matter how many workers are sharing it
+
+    Arguments:
+        rate(float):
+            Maximum number of requests per second
+    """
+
+    def __init__(self, rate: float) -> object:
+        if rate <= 0:
+            raise ValueError('The rate limit should be bigger than zero')
+        self.rate = rate
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def __str__(self):
+        return f"Rate limiter at {self.rate} requests per second"
+
+    def wait(self) -> None:
+        """
+        Description:
+            Blocks the calling thread until it is allowed to make its next request
+
+        Returns:
+            None
+        """
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch_ordered(func, items, workers: int = 4, limiter: rate_limiter = None):
+    """
+    Description:
+        Runs func for every item on a bounded pool of threads and yields the results in the same order as the items.
+        Only a window of 2 * workers requests is kept in flight, so memory does not grow with the number of items
+
+    Arguments:
+        func(callable):
+            Function to be called with a single item as argument
+
+        items(iterable):
+            The items (e.g. page numbers) to be processed
+
+        workers(int) = 4:
+            Maximum number of concurrent calls
+
+        limiter(rate_limiter) = None:
+            Optional rate limiter shared by all workers
+
+    Returns:
+        Generator with the results of func, in the same order as the items
+    """
+
+    def call(item):
+        if limiter is not None:
+            limiter.wait()
+        return func(item)
+
+    items = iter(items)
+    window = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            window.append(executor.submit(call, item))
+            if len(window) >= 2 * workers:
+                yield window.popleft().result()
+
+        while window:
+            yield window.popleft().result()
+
+
+def fetch_as_completed(func, items, workers: int = 4, limiter: rate_limiter = None):
+    """
+    Description:
+        Runs func for every item on a bounded pool of threads and yields each result as soon as it is ready.
+        Only a window of 2 * workers requests is kept in flight, so memory does not grow with the number of items
+
+    Arguments:
+        func(callable):
+            Function to be called with a single item as argument
+
+        items(iterable):
+            The items to be processed
+
+        workers(int) = 4:
+            Maximum number of concurrent calls
+
+        limiter(rate_limiter) = None:
+            Optional rate limiter shared by all workers
+
+    Returns:
+        Generator of (item, result) tuples, in the order they were completed
+    """
+
+    def call(item):
+        if limiter is not None:
+            limiter.wait()
+        return item, func(item)
+
+    items = iter(items)
+    pending = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            pending.add(executor.submit(call, item))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for future in as_completed(pending):
+            yield future.result()
+
+
+class rate_limit_controller(object):
+    """
+    Description:
+        Process-wide controller for api rate limits, shared by all workers.
+            - Concurrency is adapted AIMD-style: the number of requests allowed in flight is halved when the api answers
+                with 429 (too many requests) and grows back by one for each window of successful requests
+            - A Retry-After header pauses all workers at once, until the time requested by the api
+            - Other retryable failures (5xx, connection errors) wait a jittered exponential backoff
+        It also counts retries and the time spent waiting
+
+    Arguments:
+        max_concurrency:
+            Maximum number of requests in flight
+
+        min_concurrency:
+            The concurrency is never reduced below it
+
+        base_delay:
+            Base of the exponential backoff, in seconds
+
+        max_delay:
+            Maximum backoff (and Retry-After) wait, in seconds
+
+        max_attempts:
+            Maximum number of attempts for each request
+    """
+
+    def __init__(self, max_concurrency: int = 16, min_concurrency: int = 1, base_delay: float = 0.5,
+                 max_delay: float = 60, max_attempts: int = 8) -> object:
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.wait_time = 0.0
+
+    def __str__(self):
+        return (f"Rate limit controller: concurrency {int(self.limit)}/{self.max_concurrency}, {self.requests} requests, "
+                f"{self.retries} retries ({self.rate_limited} rate limited), {self.wait_time:.1f}s waiting")
+
+    def resize(self, max_concurrency: int) -> None:
+        """
+        Description:
+            Change the maximum number of requests in flight (e.g. to the number of workers of a script)
+
+        Returns:
+            None
+        """
+        with self.condition:
+            self.max_concurrency = max_concurrency
+            self.limit = float(max_concurrency)
+            self.condition.notify_all()
+
+    def counters(self) -> dict:
+        """
+        Returns:
+            dict with the controller counters. wait_time is summed over all workers
+        """
+        with self.condition:
+            return {'requests': self.requests,
+                    'retries': self.retries,
+                    'rate_limited': self.rate_limited,
+                    'errors': self.errors,
+                    'wait_time': round(self.wait_time, 3),
+                    'concurrency': int(self.limit)}
+
+    def acquire(self) -> None:
+        """
+        Description:
+            Blocks until a request is allowed: no global pause is active and the concurrency limit is not reached
+
+        Returns:
+            None
+        """
+        start = time.monotonic()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+            self.requests += 1
+            self.wait_time += time.monotonic() - start
+
+    def release(self, success: bool = True, rate_limited: bool = False, retry_after: float = None) -> None:
+        """
+        Description:
+            Report the outcome of a request started with acquire()
+
+        Arguments:
+            success(bool) = True:
+                If the request succeeded. Each success grows the concurrency limit by 1/limit (additive increase)
+
+            rate_limited(bool) = False:
+                If the api answered 429. The concurrency limit is halved (at most once per second,
+                    since all requests in flight tend to be rate limited together)
+
+            retry_after(float) = None:
+                Seconds requested by the api on the Retry-After header. All workers are paused for that long
+
+        Returns:
+            None
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if success:
+                self.limit = min(self.max_concurrency,
+                                 self.limit + 1 / self.limit)
+            if rate_limited:
+                self.rate_limited += 1
+                if now - self.last_decrease > 1:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self.last_decrease = now
+            if retry_after is not None:
+                self.paused_until = max(self.paused_until,
+                                        now + min(retry_after, self.max_delay))
+            self.condition.notify_all()
+
+    def backoff(self, attempt: int) -> None:
+        """
+        Description:
+            Count a retry and sleep a jittered exponential backoff ("full jitter") before it
+
+        Arguments:
+            attempt(int):
+                Number of the attempt that just failed (starting on 1)
+
+        Returns:
+            None
+        """
+        delay = random.uniform(0, min(self.max_delay,
+                                      self.base_delay * 2 ** (attempt - 1)))
+        self.count_retry()
+        with self.condition:
+            self.wait_time += delay
+        time.sleep(delay)
+
+    def count_retry(self) -> None:
+        with self.condition:
+            self.retries += 1
+
+    def count_error(self) -> None:
+        with self.condition:
+            self.errors += 1
+
+
+controller = rate_limit_controller()
+
+
+def parse_retry_after(value: str) -> float:
+    """
+    Description:
+        Parse a Retry-After header, either in seconds or as an http date
+
+    Returns:
+        float with the number of seconds to wait. None if the header is empty or can not be parsed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,87 @@
+import os
+import json
+import pathlib
+import threading
+
+
+class credential_cache(object):
+    """
+    Description:
+        On-disk cache for api credentials (e.g. the Spotify user refresh token), so they survive in between runs
+        The file is only readable by its owner
+
+    Arguments:
+        filename:
+            Name of the cache file (without the extension)
+
+        filepath:
+            Folder where the cache file is stored. If it does not exist, it will be created
+    """
+
+    def __init__(self, filename: str = 'credentials', filepath: str = './cache') -> object:
+        self.path = pathlib.Path(filepath) / f'{filename}.json'
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"Credential cache at {self.path}"
+
+    def load(self) -> dict:
+        if not self.path.is_file():
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def get(self, key: str) -> dict:
+        """
+        Arguments:
+            key(string):
+                The credential key (e.g. the app client id)
+
+        Returns:
+            dict with the stored credentials. None if there are none
+        """
+        with self.lock:
+            return self.load().get(key)
+
+    def set(self, key: str, value: dict) -> None:
+        """
+        Description:
+            Store the credentials for a key, replacing the previous ones
+
+        Arguments:
+            key(string):
+                The credential key (e.g. the app client id)
+
+            value(dict):
+                The credentials
+
+        Returns:
+            None
+        """
+        with self.lock:
+            data = self.load()
+            data[key] = value
+            self.write(data)
+
+    def remove(self, key: str) -> None:
+        """
+        Description:
+            Remove the credentials for a key (e.g. a revoked refresh token)
+        """
+        with self.lock:
+            data = self.load()
+            if key in data:
+                data.pop(key)
+                self.write(data)
+
+    def write(self, data: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_suffix('.tmp')
+        # Created with owner only permissions, since it stores secrets
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,169 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests as re
+from requests.adapters import HTTPAdapter
+
+
+# (connect, read) timeouts in seconds for each api host
+DEFAULT_TIMEOUTS = {
+    'api.spotify.com': (5, 30),
+    'accounts.spotify.com': (5, 30),
+    'ws.audioscrobbler.com': (5, 60),
+}
+DEFAULT_TIMEOUT = (5, 30)
+
+# Environment variables overriding the base url of each api (e.g. to point the scripts to a local stand-in server)
+BASE_URL_ENVS = {
+    'https://api.spotify.com': 'SPOTIFY_API_URL',
+    'https://accounts.spotify.com': 'SPOTIFY_ACCOUNTS_URL',
+    'http://ws.audioscrobbler.com': 'LASTFM_API_URL',
+}
+
+
+def base_url_overrides() -> dict:
+    """
+    Returns:
+        dict with the overridden base urls set on the environment ({original base url: new base url})
+    """
+    return {base_url: os.environ[env].rstrip('/')
+            for base_url, env in BASE_URL_ENVS.items() if os.environ.get(env)}
+
+
+class http_client(object):
+    """
+    Description:
+        HTTP client shared by the Last.fm and Spotify apis.
+        All requests go through a single requests.Session, so connections are kept alive and reused (no new TCP+TLS
+            handshake per request). The connection pool is sized to the number of concurrent workers
+
+    Arguments:
+        pool_size:
+            Maximum number of connections kept open per host. It should be at least the number of concurrent workers
+
+        timeouts:
+            dict with (connect, read) timeouts in seconds per host. Hosts not listed use DEFAULT_TIMEOUT
+
+        compression:
+            If True, gzip/deflate compressed responses are requested
+
+        base_urls:
+            dict with the api base urls to be replaced ({original base url: new base url})
+            If None, the overrides set on the environment (BASE_URL_ENVS) are used
+    """
+
+    def __init__(self, pool_size: int = 10, timeouts: dict = None, compression: bool = True,
+                 base_urls: dict = None) -> object:
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts is not None:
+            self.timeouts.update(timeouts)
+        self.base_urls = base_url_overrides() if base_urls is None else base_urls
+        self.compression = compression
+        self.session = re.Session()
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate' if compression else 'identity'
+        self.resize(pool_size)
+
+    def __str__(self):
+        return f"HTTP client with a pool of {self.pool_size} connections per host"
+
+    def resize(self, pool_size: int) -> None:
+        """
+        Description:
+            Change the connection pool size (e.g. when the number of workers changes)
+
+        Arguments:
+            pool_size(int):
+                Maximum number of connections kept open per host
+
+        Returns:
+            None
+        """
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def timeout(self, url: str) -> tuple:
+        return self.timeouts.get(urlsplit(url).hostname, DEFAULT_TIMEOUT)
+
+    def rewrite(self, url: str) -> str:
+        for base_url, new_base_url in self.base_urls.items():
+            if url.startswith(base_url):
+                return new_base_url + url[len(base_url):]
+        return url
+
+    def request(self, method: str, url: str, **kwargs) -> re.Response:
+        """
+        Description:
+            Makes the request on the pooled session, using the host timeout if none was passed
+            Overridden base urls are replaced before the request
+
+        Returns:
+            requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout(url))
+        return self.session.request(method, self.rewrite(url), **kwargs)
+
+    def get(self, url: str, **kwargs) -> re.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, data=None, **kwargs) -> re.Response:
+        return self.request('POST', url, data=data, **kwargs)
+
+    def put(self, url: str, data=None, **kwargs) -> re.Response:
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> re.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> http_client:
+    """
+    Description:
+        The process-wide HTTP client. It is created on the first call with the default settings
+
+    Returns:
+        http_client
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = http_client()
+        return _client
+
+
+def configure_client(pool_size: int = None, timeouts: dict = None, compression: bool = None) -> http_client:
+    """
+    Description:
+        Change the settings of the process-wide HTTP client. Scripts should call it with their concurrency level
+
+    Arguments:
+        pool_size(int) = None:
+            Maximum number of connections kept open per host
+
+        timeouts(dict) = None:
+            (connect, read) timeouts per host to be updated
+
+        compression(bool) = None:
+            If compressed responses should be requested
+
+    Returns:
+        http_client
+    """
+    client = get_client()
+    if pool_size is not None and pool_size != client.pool_size:
+        client.resize(pool_size)
+    if timeouts is not None:
+        client.timeouts.update(timeouts)
+    if compression is not None:
+        client.compression = compression
+        client.session.headers['Accept-Encoding'] = 'gzip, deflate' if compression else 'identity'
+    return client
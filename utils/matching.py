@@ -0,0 +1,170 @@
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+
+# Suffixes after " - " that only describe a release of the same recording (e.g. "Song - Remastered 2009")
+# Live, acoustic or remixed versions are other recordings, with other features, so they are kept
+VERSION_WORDS = ['remaster', 'mono', 'stereo', 'edit', 'deluxe', 'bonus', 'single version', 'album version',
+                 'explicit', 'anniversary']
+VERSION_SUFFIX = re.compile(r'\s-\s[^-]*(' + '|'.join(VERSION_WORDS) + r')[^-]*$')
+# Parentheses or brackets with credits or version descriptions (e.g. "(feat. Someone)", "[Remastered]")
+BRACKETS = re.compile(r'[\(\[][^\)\]]*(feat|ft\.|with |' +
+                      '|'.join(VERSION_WORDS) + r')[^\)\]]*[\)\]]')
+FEATURING = re.compile(r'\s(feat\.?|ft\.?|featuring)\s.*$')
+PUNCTUATION = re.compile(r'[^\w\s]')
+NUMBERS = re.compile(r'\d+')
+
+# Minimum similarity for a search result to be accepted
+MIN_ARTIST_SCORE = 0.85
+MIN_TITLE_SCORE = 0.8
+# Titles with up to this number of words must be equal (ignoring spaces), since a single letter changes the song
+SHORT_TITLE_WORDS = 2
+
+
+def strip_accents(value: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFKD', value)
+                   if not unicodedata.combining(c))
+
+
+def normalize_title(title: str) -> str:
+    """
+    Description:
+        Normalize a song title for matching: case, accents, punctuation, featured artists
+            and release descriptions ("- Remastered 2009", "(Radio Edit)", "[Mono]") are ignored
+
+    Arguments:
+        title(string):
+            The song title
+
+    Returns:
+        string with the normalized title
+    """
+    title = strip_accents(str(title)).casefold()
+    title = BRACKETS.sub(' ', title)
+    title = VERSION_SUFFIX.sub(' ', title)
+    title = FEATURING.sub(' ', title)
+    title = title.replace('&', ' and ')
+    title = PUNCTUATION.sub(' ', title)
+    return ' '.join(title.split())
+
+
+def normalize_artist(artist: str) -> str:
+    """
+    Description:
+        Normalize an artist name for matching: case, accents, punctuation, a leading "the" and featured artists are ignored
+
+    Arguments:
+        artist(string):
+            The artist name
+
+    Returns:
+        string with the normalized name
+    """
+    artist = strip_accents(str(artist)).casefold()
+    artist = FEATURING.sub(' ', artist)
+    artist = artist.replace('&', ' and ')
+    artist = PUNCTUATION.sub(' ', artist)
+    artist = ' '.join(artist.split())
+    if artist.startswith('the '):
+        artist = artist[4:]
+    return artist
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    Returns:
+        float from 0 to 1 with the similarity in between two normalized strings
+    """
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def same_title(a: str, b: str) -> bool:
+    """
+    Description:
+        Check if two normalized titles can be the same song, before comparing how similar they are
+        Numbers must be the same ("Part 1" is not "Part 2", but "Track 01" is "Track 1"),
+            and short titles must be equal ignoring spaces ("Song 2" is not "Song 3", "don t" is "dont")
+
+    Arguments:
+        a(string):
+            A normalized title
+
+        b(string):
+            Another normalized title
+
+    Returns:
+        bool, True if the titles can be the same song
+    """
+    if a == b:
+        return True
+    if [int(n) for n in NUMBERS.findall(a)] != [int(n) for n in NUMBERS.findall(b)]:
+        return False
+    if min(len(a.split()), len(b.split())) <= SHORT_TITLE_WORDS:
+        return NUMBERS.sub(lambda n: str(int(n.group())), a).replace(' ', '') == \
+            NUMBERS.sub(lambda n: str(int(n.group())), b).replace(' ', '')
+    return True
+
+
+def score_candidate(candidate: dict, title: str, artist: str) -> tuple:
+    """
+    Description:
+        Score a search result against the searched song, comparing the title and all the track and album artists
+
+    Arguments:
+        candidate(dict):
+            A track object from the spotify search response
+
+        title(string):
+            The normalized searched title
+
+        artist(string):
+            The normalized searched artist
+
+    Returns:
+        tuple with the (artist score, title score). The title score is 0 if the titles can not be the same song
+    """
+    artists = candidate.get('artists', []) + \
+        candidate.get('album', {}).get('artists', [])
+    artist_score = max([similarity(artist, normalize_artist(a['name'])) for a in artists],
+                       default=0.0)
+    name = normalize_title(candidate.get('name', ''))
+    title_score = similarity(title, name) if same_title(title, name) else 0.0
+    return artist_score, title_score
+
+
+def best_match(candidates: list, song_name: str, band_name: str) -> dict:
+    """
+    Description:
+        Pick the best search result for a song, among all the candidates of the returned page
+        Compilation albums (e.g. "Various Artists") are handled, since the track artists are compared as well
+
+    Arguments:
+        candidates(list):
+            The track objects from the spotify search response
+
+        song_name(string):
+            Name of the song
+
+        band_name(string):
+            Name of the band
+
+    Returns:
+        dict with the best candidate. None if no candidate is similar enough
+    """
+    title = normalize_title(song_name)
+    artist = normalize_artist(band_name)
+
+    best, best_score = None, None
+    for candidate in candidates or []:
+        artist_score, title_score = score_candidate(candidate, title, artist)
+        if artist_score < MIN_ARTIST_SCORE or title_score < MIN_TITLE_SCORE:
+            continue
+        # Ties are broken by the track popularity
+        score = (artist_score + title_score, candidate.get('popularity', 0))
+        if best_score is None or score > best_score:
+            best, best_score = candidate, score
+
+    return best
@@ -0,0 +1,176 @@
+import sys
+import time
+import threading
+
+
+class progress_reporter(object):
+    """
+    Description:
+        Progress and throughput reporting for long loops (api pages, searches, playlists...)
+        Counters are cheap to update: the status line is only rendered when the refresh interval has passed.
+        On a terminal the line is rewritten in place, otherwise (logs, containers) one line is printed per interval
+
+    Arguments:
+        description:
+            What is being processed, printed at the start of the status line
+
+        total:
+            Total number of items to be processed (if known). It is used for the percentage and the ETA
+
+        interval:
+            Minimum number of seconds in between two refreshes.
+            If None, 0.5 seconds on a terminal and 10 seconds on log mode
+
+        stream:
+            Where the status is written. Default is the standard output
+
+        log_mode:
+            If True, prints one line per refresh instead of rewriting it. If None, it is True when the stream is not a terminal
+
+        controller:
+            Optional rate limit controller (utils.concurrency.rate_limit_controller) whose failed requests, retries
+                and wait time are reported too (counted from the moment the reporter is created)
+    """
+
+    def __init__(self, description: str, total: int = None, interval: float = None, stream=None, log_mode: bool = None,
+                 controller=None) -> object:
+        self.description = description
+        self.controller = controller
+        self.total = total
+        self.stream = stream if stream is not None else sys.stdout
+        if log_mode is None:
+            log_mode = not (hasattr(self.stream, 'isatty')
+                            and self.stream.isatty())
+        self.log_mode = log_mode
+        if interval is None:
+            interval = 10 if log_mode else 0.5
+        self.interval = interval
+
+        self.done = 0
+        self.errors = 0
+        self.retries = 0
+        # The controller is shared by the whole process: only what happens after this point is reported
+        self.controller_start = controller.counters() if controller is not None else None
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.next_refresh = self.start_time + self.interval
+        self.last_length = 0
+
+    def __str__(self):
+        return self.status()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def update(self, n: int = 1, errors: int = 0, retries: int = 0) -> None:
+        """
+        Description:
+            Count processed items (and errors or retries). Safe to be called from concurrent workers
+
+        Arguments:
+            n(int) = 1:
+                Number of items processed
+
+            errors(int) = 0:
+                Number of errors
+
+            retries(int) = 0:
+                Number of retries
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.done += n
+            self.errors += errors
+            self.retries += retries
+            now = time.monotonic()
+            if now < self.next_refresh:
+                return
+            self.next_refresh = now + self.interval
+        self.render()
+
+    def error(self, n: int = 1) -> None:
+        self.update(n=0, errors=n)
+
+    def retry(self, n: int = 1) -> None:
+        self.update(n=0, retries=n)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def rate(self) -> float:
+        """
+        Returns:
+            float with the number of items processed per second
+        """
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def status(self, final: bool = False) -> str:
+        """
+        Arguments:
+            final(bool) = False:
+                If True, the total elapsed time is shown instead of the ETA
+
+        Returns:
+            string with the current status line
+        """
+        rate = self.rate()
+        if self.total:
+            line = f"{self.description}: {self.done}/{self.total} ({self.done / self.total:.0%})"
+        else:
+            line = f"{self.description}: {self.done}"
+        line += f" | {rate:.1f}/s"
+        if final:
+            line += f" | done in {format_seconds(self.elapsed())}"
+        elif self.total and rate > 0:
+            line += f" | ETA {format_seconds((self.total - self.done) / rate)}"
+        else:
+            line += f" | elapsed {format_seconds(self.elapsed())}"
+        errors, retries, wait_time = self.errors, self.retries, 0
+        if self.controller is not None:
+            counters = self.controller.counters()
+            errors += counters['errors'] - self.controller_start['errors']
+            retries += counters['retries'] - self.controller_start['retries']
+            wait_time = counters['wait_time'] - self.controller_start['wait_time']
+        if errors:
+            line += f" | errors {errors}"
+        if wait_time >= 1:
+            line += f" | waited {format_seconds(wait_time)}"
+        if retries:
+            line += f" | retries {retries}"
+        return line
+
+    def render(self) -> None:
+        line = self.status()
+        if self.log_mode:
+            self.stream.write(line + '\n')
+        else:
+            # Pad with spaces to clean any leftover of a longer previous line
+            self.stream.write('\r' + line.ljust(self.last_length))
+            self.last_length = len(line)
+        self.stream.flush()
+
+    def close(self) -> None:
+        """
+        Description:
+            Render the final status, with the total elapsed time
+        """
+        line = self.status(final=True)
+        if self.log_mode:
+            self.stream.write(line + '\n')
+        else:
+            self.stream.write('\r' + line.ljust(self.last_length) + '\n')
+        self.stream.flush()
+
+
+def format_seconds(seconds: float) -> str:
+    """
+    Format a number of seconds on a h:mm:ss string
+    """
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
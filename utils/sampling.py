@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+
+# Weighting strategies of the playlist songs sampling
+STRATEGIES = ['uniform', 'play_count', 'recency', 'centroid']
+
+
+def sampling_weights(df: pd.DataFrame, strategy: str = 'uniform', half_life: float = 90, model: dict = None) -> np.ndarray:
+    """
+    Description:
+        Weight of each song on the sampling: the bigger the weight, the more likely the song is picked
+
+    Arguments:
+        df(pd.DataFrame):
+            The clusterized songs, with the columns the strategy needs
+
+        strategy(string) = 'uniform':
+            uniform: every song is equally likely
+            play_count: songs are weighted by their play count (play_count column)
+            recency: songs lose half of their weight every half_life days since they were last played (last_played column),
+                counting back from the most recent play
+            centroid: songs closer to their cluster centroid (the most typical songs of the cluster) weigh more
+                Needs the cluster model artifact (scaler, features and centroids)
+
+        half_life(float) = 90:
+            Days for a song to lose half of its weight on the recency strategy
+
+        model(dict) = None:
+            The cluster model artifact (clusterization_model.pkl), used on the centroid strategy
+
+    Returns:
+        numpy array with the weight of each song, or None for the uniform strategy
+    """
+
+    if strategy == 'uniform':
+        return None
+    elif strategy == 'play_count':
+        return df['play_count'].to_numpy(dtype=np.float64)
+    elif strategy == 'recency':
+        age = (df['last_played'].max() - df['last_played'].to_numpy(dtype=np.float64)) / (24 * 3600)
+        return 0.5 ** (age / half_life)
+    elif strategy == 'centroid':
+        if model is None:
+            raise Exception('No cluster model saved. Run the clusterization again to weight the songs by centroid distance')
+        X = model['scaler'].transform(df[model['features']])
+        distance = np.linalg.norm(X - model['centroids'][df['cluster'].to_numpy(dtype=np.int64)], axis=1)
+        return np.exp(-distance / max(distance.mean(), 1e-12))
+    else:
+        raise Exception(f'Unknown sampling strategy {strategy}. Use one of {", ".join(STRATEGIES)}')
+
+
+def sample_clusters(clusters: np.ndarray, n: int, weights: np.ndarray = None, random_state: int = None) -> dict:
+    """
+    Description:
+        Sample up to n songs of every cluster without replacement, in a single vectorized pass over all the songs
+        Every song gets a random key (log(u) / weight, Efraimidis-Spirakis weighted sampling), the songs are sorted once
+            by key and cluster, and the first n songs of each cluster are the sample
+        Clusters with less than n songs are taken whole, instead of failing
+
+    Arguments:
+        clusters(np.ndarray):
+            Cluster of each song
+
+        n(int):
+            Maximum number of songs per cluster
+
+        weights(np.ndarray) = None:
+            Weight of each song (see sampling_weights). If None, every song is equally likely. Songs with no weight are only
+                picked when their cluster has no other songs left
+
+        random_state(int) = None:
+            Seed of the sampling. If None, every run picks different songs
+
+    Returns:
+        dict with the cluster as key and a numpy array with the positions of its sampled songs as value
+    """
+
+    clusters = np.asarray(clusters)
+    if len(clusters) == 0:
+        return {}
+    rng = np.random.default_rng(random_state)
+    # 1 - random is on (0, 1], so the log is always finite
+    keys = np.log(1 - rng.random(len(clusters)))
+    if weights is not None:
+        with np.errstate(divide='ignore'):
+            keys = keys / np.asarray(weights, dtype=np.float64)
+
+    # Sorted by descending key and then by cluster (stable), so each cluster is a contiguous block with its best keys first
+    # Clusters are sorted as small integer codes, which numpy sorts in linear time (radix sort)
+    codes, labels = pd.factorize(clusters, sort=True)
+    codes = codes.astype(np.int16 if len(labels) < 2 ** 15 else np.int32)
+    order = np.argsort(-keys)
+    order = order[np.argsort(codes[order], kind='stable')]
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    rank = np.arange(len(order)) - np.repeat(starts, sizes)
+
+    picked = order[rank < n]
+    bounds = np.cumsum(np.minimum(sizes, n))[:-1]
+    return dict(zip(np.asarray(labels)[sorted_codes[starts]].tolist(), np.split(picked, bounds)))
@@ -0,0 +1,210 @@
+import os
+import shutil
+import pathlib
+
+import pandas as pd
+
+from utils.storage import apply_schema
+
+
+# Scrobbles are unique by the moment they were played and the track itself
+KEY = ['unix_timestamp', 'artist', 'song']
+COLUMNS = ['artist', 'song', 'unix_timestamp', 'nowplaying']
+
+
+def partition_name(unix_timestamp: pd.Series) -> pd.Series:
+    """
+    Description:
+        The partition (UTC year and month, YYYY-MM) where each scrobble should be stored
+
+    Arguments:
+        unix_timestamp(pd.Series):
+            The scrobbles unix timestamps
+
+    Returns:
+        pd.Series with the partition names
+    """
+    return pd.to_datetime(unix_timestamp, unit='s').dt.strftime('%Y-%m')
+
+
+def list_partitions(filepath: str) -> list:
+    """
+    Description:
+        List all stored partitions, ordered from the oldest to the newest
+
+    Arguments:
+        filepath(string):
+            Folder where the partitions are stored
+
+    Returns:
+        list with the partition names (YYYY-MM)
+    """
+    if not pathlib.Path(filepath).is_dir():
+        return []
+    return sorted(path.stem for path in pathlib.Path(filepath).glob('*.parquet'))
+
+
+def read_partition(filepath: str, partition: str, columns: list = None) -> pd.DataFrame:
+    """
+    Description:
+        Read a single partition (only the declared columns, if any). If it does not exist, returns an empty dataframe
+    """
+    path = pathlib.Path(filepath) / f'{partition}.parquet'
+    if not path.is_file():
+        return pd.DataFrame(columns=COLUMNS if columns is None else columns)
+    return pd.read_parquet(path, columns=columns)
+
+
+def write_partition(filepath: str, partition: str, df: pd.DataFrame) -> None:
+    """
+    Description:
+        Write a single partition. The file is first written to a temporary path and then moved,
+            so an interrupted run never leaves a half written partition behind
+    """
+    pathlib.Path(filepath).mkdir(parents=True, exist_ok=True)
+    path = pathlib.Path(filepath) / f'{partition}.parquet'
+    temp_path = pathlib.Path(filepath) / f'{partition}.parquet.tmp'
+    df.to_parquet(temp_path, index=False)
+    os.replace(temp_path, path)
+
+
+def prepare(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Description:
+        Enforce the stored columns and data types on a scrobbles dataframe
+    """
+    df = df.copy()
+    if 'nowplaying' not in df.columns:
+        df['nowplaying'] = False
+    df = apply_schema(filename='lastfm_played_tracks', df=df)
+    return df[COLUMNS]
+
+
+def upsert_scrobbles(df: pd.DataFrame, filepath: str) -> list:
+    """
+    Description:
+        Store new scrobbles, rewriting only the month partitions touched by them.
+        Rows are upserted on (unix_timestamp, artist, song), so scrobbles fetched again are not duplicated.
+        Tracks stored as currently playing are always replaced by the new results,
+            since on the next extraction they are either scrobbled with their real timestamp or still playing
+
+    Arguments:
+        df(pd.DataFrame):
+            The new scrobbles, with artist, song, unix_timestamp and (optionally) nowplaying columns
+
+        filepath(string):
+            Folder where the partitions are stored
+
+    Returns:
+        list with the partitions that were written
+    """
+    df = prepare(df)
+    df['partition'] = partition_name(df['unix_timestamp'])
+
+    # Stored "now playing" rows always have the greatest timestamp, so they can only be on the newest partition
+    touched = set(df['partition'])
+    stored_partitions = list_partitions(filepath)
+    if stored_partitions:
+        touched.add(stored_partitions[-1])
+
+    for partition in sorted(touched):
+        stored = read_partition(filepath, partition)
+        stored = stored[~stored['nowplaying']]
+        new = df[df['partition'] == partition].drop(columns='partition')
+
+        merged = pd.concat([stored, new], ignore_index=True)
+        merged = prepare(merged)
+        merged = merged.drop_duplicates(subset=KEY, keep='last')
+        merged = merged.sort_values('unix_timestamp', ascending=False)
+
+        write_partition(filepath, partition, merged)
+
+    return sorted(touched)
+
+
+def load_scrobbles(filepath: str, start: int = None, end: int = None, nowplaying: bool = True,
+                   columns: list = None) -> pd.DataFrame:
+    """
+    Description:
+        Load the stored scrobbles, reading only the partitions overlapping the requested time range
+
+    Arguments:
+        filepath(string):
+            Folder where the partitions are stored
+
+        start(int) = None:
+            Unix timestamp of the beginning of the range (inclusive). If None, reads from the first scrobble
+
+        end(int) = None:
+            Unix timestamp of the end of the range (inclusive). If None, reads up to the last scrobble
+
+        nowplaying(bool) = True:
+            If False, tracks stored as currently playing are left out
+
+        columns(list) = None:
+            If declared, only these columns are read from the partitions
+
+    Returns:
+        pd.DataFrame with artist, song and unix_timestamp columns (or the declared ones). If there are no partitions, returns None
+    """
+    if columns is None:
+        columns = COLUMNS[:3]
+    # Columns needed to filter the rows are read as well and dropped at the end
+    read_columns = list(columns)
+    for column, needed in [('unix_timestamp', start is not None or end is not None),
+                           ('nowplaying', not nowplaying)]:
+        if needed and column not in read_columns:
+            read_columns.append(column)
+
+    partitions = list_partitions(filepath)
+    if not partitions:
+        return None
+
+    if start is not None:
+        first = partition_name(pd.Series([start])).item()
+        partitions = [p for p in partitions if p >= first]
+    if end is not None:
+        last = partition_name(pd.Series([end])).item()
+        partitions = [p for p in partitions if p <= last]
+
+    frames = [read_partition(filepath, partition, columns=read_columns)
+              for partition in reversed(partitions)]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = apply_schema(filename='lastfm_played_tracks',
+                      df=pd.concat(frames, ignore_index=True))
+
+    if start is not None:
+        df = df[df['unix_timestamp'] >= start]
+    if end is not None:
+        df = df[df['unix_timestamp'] <= end]
+    if not nowplaying:
+        df = df[~df['nowplaying']]
+
+    return df[columns].reset_index(drop=True)
+
+
+def max_timestamp(filepath: str) -> int:
+    """
+    Description:
+        The timestamp of the last scrobble stored (tracks stored as currently playing are ignored)
+        Only the newest partitions are read
+
+    Returns:
+        int with the unix timestamp. If nothing is stored, returns None
+    """
+    for partition in reversed(list_partitions(filepath)):
+        df = read_partition(filepath, partition)
+        df = df[~df['nowplaying'].astype(bool)]
+        if len(df) > 0:
+            return int(df['unix_timestamp'].max())
+    return None
+
+
+def remove_scrobbles(filepath: str) -> None:
+    """
+    Description:
+        Remove all stored partitions
+    """
+    if pathlib.Path(filepath).is_dir():
+        shutil.rmtree(filepath)
@@ -1,9 +1,7 @@
-import os
-import sys
 import json
 import base64
 import time
-from math import ceil
+import threading
 
 import numpy as np
 import pandas as pd
@@ -11,63 +9,255 @@ import urllib.parse
 import requests as re
 from selenium import webdriver
 
+from utils.concurrency import rate_limiter, fetch_as_completed, controller, parse_retry_after
+from utils.progress import progress_reporter
+from utils.http_client import get_client
+from utils.credentials import credential_cache
+from utils.matching import best_match
+from utils.storage import FEATURES_DTYPES
+
+
+FEATURES_COLUMNS = ['danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+                    'instrumentalness', 'liveness', 'valence', 'tempo', 'type', 'id', 'uri', 'track_href',
+                    'analysis_url', 'duration_ms', 'time_signature']
+
+# Status codes worth a retry: rate limits, internal server errors and unavailable gateways
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
 
 def api_call(func):
     """
     This is just a wrapper for the api requests.
         In case the request is good, it will return the api response
 
-        If we get an internal server error or exceed the api limits, it will wait for 5 seconds and retry (up to 8 times)
+        All requests go through the process-wide rate limit controller (utils.concurrency.controller), so concurrent workers back off together:
+            If we exceed the api limits (429), all workers wait for the Retry-After header time and the concurrency is reduced
+            If we get a server error (5xx) or a connection error, it waits a jittered exponential backoff and retries
+            After controller.max_attempts attempts (8 by default), raises an exception
+
+        If we get a 401 (expired access token) on a request authenticated with a bearer_token, the token is refreshed and the request is made again
+        Tokens are only refreshed while no controller slot is held, and the token requests (token_request) never take one
 
         If we get another error, raises an exception and prints the response error
 
         More info: https://developer.spotify.com/documentation/web-api/
     """
     def wrapper(*args, **kwargs):
-        attempt = 1
-        while attempt <= 8:
-            r = func(*args, **kwargs)
+        refreshed = False
+        for attempt in range(1, controller.max_attempts + 1):
+            if isinstance(kwargs.get('auth'), bearer_token):
+                # Refresh an expiring token before taking a request slot, since the refresh is a request itself
+                kwargs['auth'].get()
+            controller.acquire()
+            try:
+                r = func(*args, **kwargs)
+            except (re.ConnectionError, re.Timeout):
+                controller.release(success=False)
+                controller.count_error()
+                if attempt == controller.max_attempts:
+                    raise
+                controller.backoff(attempt)
+                continue
+
             if r.status_code in [200, 201, 202, 204]:
+                controller.release(success=True)
                 return r
-            elif r.status_code in [429, 500]:
-                time.sleep(5)
-                print(
-                    f'Attempt number {attempt} with status code {r.status_code}. Retrying...')
-                attempt += 1
+            elif r.status_code == 401 and isinstance(kwargs.get('auth'), bearer_token) and not refreshed:
+                # Expired or revoked access token: refresh it once and try again
+                controller.release(success=False)
+                kwargs['auth'].refresh(
+                    expired=r.request.headers.get('Authorization'))
+                refreshed = True
+                continue
+            elif r.status_code in RETRY_STATUS:
+                retry_after = parse_retry_after(
+                    r.headers.get('Retry-After')) if r.status_code == 429 else None
+                controller.release(success=False,
+                                   rate_limited=r.status_code == 429,
+                                   retry_after=retry_after)
+                controller.count_error()
+                if attempt == controller.max_attempts:
+                    break
+                if retry_after is None:
+                    controller.backoff(attempt)
+                else:
+                    # The wait happens on the next acquire, together with all the other workers
+                    controller.count_retry()
                 continue
             else:
+                controller.release(success=False)
+                try:
+                    error = r.json()
+                except ValueError:
+                    error = r.text
                 raise Exception(
-                    f'Error: Bad api call, please try again: {r.json()}')
+                    f'Error: Bad api call, please try again: {error}')
+
+        raise Exception(
+            f'Error: api call failed after {controller.max_attempts} attempts with status code {r.status_code}')
     return wrapper
 
 
+def token_request(data: dict, headers: dict = None, attempts: int = 5) -> re.Response:
+    """
+    Post to the spotify token endpoint on the shared pooled http client, with its own small retry loop
+    Token requests do not take a rate limit controller slot: a token refresh can happen while a worker
+        already holds one, and waiting for another slot could block all of them
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            r = get_client().post(url='https://accounts.spotify.com/api/token', data=data, headers=headers)
+        except (re.ConnectionError, re.Timeout):
+            if attempt == attempts:
+                raise
+            controller.backoff(attempt)
+            continue
+
+        if r.status_code == 200:
+            return r
+        elif r.status_code in RETRY_STATUS and attempt < attempts:
+            retry_after = parse_retry_after(r.headers.get('Retry-After')) if r.status_code == 429 else None
+            if retry_after is None:
+                controller.backoff(attempt)
+            else:
+                controller.count_retry()
+                time.sleep(retry_after)
+            continue
+
+        try:
+            error = r.json()
+        except ValueError:
+            error = r.text
+        raise Exception(f'Error: token request failed with status code {r.status_code}: {error}')
+
+
 @api_call
 def get_request(*args, **kwargs):
     """
-    Execute requests.get using the @api_call decorator
+    Execute a get request on the shared pooled http client using the @api_call decorator
     """
-    r = re.get(*args, **kwargs)
+    r = get_client().get(*args, **kwargs)
     return r
 
 
 @api_call
 def post_request(*args, **kwargs):
     """
-    Execute requests.post using the @api_call decorator
+    Execute a post request on the shared pooled http client using the @api_call decorator
     """
-    r = re.post(*args, **kwargs)
+    r = get_client().post(*args, **kwargs)
     return r
 
 
 @api_call
 def delete_request(*args, **kwargs):
     """
-    Execute requests.delete using the @api_call decorator
+    Execute a delete request on the shared pooled http client using the @api_call decorator
+    """
+    r = get_client().delete(*args, **kwargs)
+    return r
+
+
+@api_call
+def put_request(*args, **kwargs):
+    """
+    Execute a put request on the shared pooled http client using the @api_call decorator
     """
-    r = re.delete(*args, **kwargs)
+    r = get_client().put(*args, **kwargs)
     return r
 
 
+def song_uris(songs: list) -> list:
+    """
+    Returns a list with the spotify uris of the songs (it accepts song ids, song uris or both)
+    """
+    return ["spotify:track:" + song_id if "spotify:track:" not in song_id else song_id for song_id in songs]
+
+
+def page_uris(page: dict) -> list:
+    """
+    Returns a list with the song uris of a parsed playlist tracks page (items without a track are skipped)
+    """
+    return [item['track']['uri'] for item in page.get('items', []) if item.get('track')]
+
+
+def batches(items: list, size: int = 100) -> list:
+    """
+    Returns a list with the items in chunks of up to `size` elements (the playlist endpoints accept 100 songs at a time)
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class bearer_token(re.auth.AuthBase):
+    """
+    Description:
+        Spotify access token, to be passed as the `auth` of the requests.
+        It is refreshed before it expires, or when the api rejects it (401), so long runs never fail halfway through.
+        The token is shared by all workers: only one of them refreshes it at a time
+
+    Arguments:
+        fetch:
+            Function that requests a new token and returns the token endpoint json
+            (access_token, expires_in and optionally a new refresh_token)
+    """
+
+    def __init__(self, fetch) -> object:
+        self.fetch = fetch
+        self.access_token = None
+        self.expires_at = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, r):
+        # The token is checked (and refreshed if needed) by @api_call before the request takes a controller slot
+        # It is not refreshed here: if it expires in the meantime, the 401 path refreshes it
+        r.headers['Authorization'] = f'Bearer {self.access_token}'
+        return r
+
+    def __str__(self):
+        return f"Spotify access token valid until {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.expires_at))}"
+
+    def set(self, token: dict) -> None:
+        """
+        Description:
+            Store a token returned by the token endpoint
+
+        Arguments:
+            token(dict):
+                The token endpoint json, with access_token and expires_in
+
+        Returns:
+            None
+        """
+        self.access_token = token['access_token']
+        self.expires_at = time.time() + int(token.get('expires_in', 3600))
+
+    def get(self) -> str:
+        """
+        Returns:
+            string with a valid access token. It is refreshed if it expires in less than a minute
+        """
+        with self.lock:
+            if self.access_token is None or time.time() >= self.expires_at - 60:
+                self.set(self.fetch())
+            return self.access_token
+
+    def refresh(self, expired: str = None) -> None:
+        """
+        Description:
+            Force a new token
+
+        Arguments:
+            expired(string) = None:
+                Authorization header of the rejected request. If another worker already replaced that token, nothing is done
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if expired is None or expired == f'Bearer {self.access_token}':
+                self.set(self.fetch())
+
+
 class spotify_requests(object):
     """
     Description:
@@ -81,43 +271,46 @@ class spotify_requests(object):
         client_secret:
             The app client_secret
 
-        headers:
-            The api request headers
+        token:
+            The app access token (bearer_token), refreshed automatically when it expires
     """
 
     def __init__(self, client_id: str, client_secret: str) -> object:
         self.client_id = client_id
         self.client_secret = client_secret
-        self.headers = self.get_headers()
+        self.token = bearer_token(fetch=self.get_token)
+        self.token.get()
 
     def __str__(self):
         return f"Spotify App client id {self.client_id}"
 
-    def get_headers(self):
+    def get_token(self) -> dict:
         """
         Description:
-            Authenticate the spotify app to retrieve a client_secret and generate the headers
-
-        Arguments:
-            client_id(string): 
-                The spotify app client id
-
-            client_secret(string): 
-                The spotify app client secret
+            Authenticate the spotify app (client credentials flow) to retrieve a new access token
 
         Returns:
-            string with the headers on a json format
+            dict with the token endpoint json (access_token, expires_in)
         """
 
-        auth_response = re.post('https://accounts.spotify.com/api/token', {
+        r = token_request(data={
             'grant_type': 'client_credentials',
             'client_id': self.client_id,
             'client_secret': self.client_secret,
         })
 
-        access_token = auth_response.json()['access_token']
+        return r.json()
 
-        return {'Authorization': f'Bearer {access_token}'}
+    def get_headers(self):
+        """
+        Description:
+            Generate the headers with the current access token
+
+        Returns:
+            string with the headers on a json format
+        """
+
+        return {'Authorization': f'Bearer {self.token.get()}'}
 
     def search_song(self, song_name: str, band_name: str) -> json:
         """
@@ -139,7 +332,7 @@ class spotify_requests(object):
         encoded_song_name = urllib.parse.quote_plus(song_name)
 
         r = get_request(url='https://api.spotify.com/v1/search?' + 'q=artist:' + encoded_band_name + '%20track:' +
-                        encoded_song_name + '&market:from_token' + '&type=track&limit=50&include_external=audio', headers=self.headers)
+                        encoded_song_name + '&market:from_token' + '&type=track&limit=50&include_external=audio', auth=self.token)
         try:
             return r.json()['tracks']['items']
         except:
@@ -148,7 +341,7 @@ class spotify_requests(object):
     def find_song_id(self, song_name: str, band_name: str) -> str:
         """
         Description:
-            Makes the search song api request and iterate on the responde to get the spotify song id
+            Makes the search song api request and picks the best matching result to get the spotify song id
 
         Arguments:
             song_name(string): 
@@ -160,66 +353,135 @@ class spotify_requests(object):
         Returns:
             string with the spotify song id for the song (or 'not_found' if not found)
         """
-        os.system('clear')
-        print(f"Searching for song {song_name} by {band_name}")
         response = self.search_song(song_name, band_name)
-        if response is not None:
-            for i in range(len(response)):
-                if response[i]['album']['artists'][0]['name'] == band_name:
-                    return response[i]['id']
-                else:
-                    continue
+        # Every result is scored against the normalized title and all the track artists
+        match = best_match(candidates=response,
+                           song_name=song_name,
+                           band_name=band_name)
+        if match is not None:
+            return match['id']
         # if no returns, we could not find id, so it returns not_found
         return 'not_found'
 
-    def get_songs_features(self, ids: pd.Series) -> pd.DataFrame:
+    def find_songs_ids(self, tracks: pd.DataFrame or list, workers: int = 8, limiter: rate_limiter = None):
+        """
+        Description:
+            Batch version of find_song_id: runs the searches concurrently and streams the results back as they are ready,
+                so they can be saved incrementally
+            All workers share the same rate limiter and the @api_call retry policy
+
+        Arguments:
+            tracks(pd.DataFrame, list):
+                A dataframe with artist and song columns or an iterable of (artist, song) tuples
+
+            workers(int) = 8:
+                Number of concurrent searches
+
+            limiter(rate_limiter) = None:
+                Rate limiter shared by the workers. If None, searches are limited to 20 per second
+
+        Returns:
+            Generator of (artist, song, spotify song id) tuples, in the order the searches were completed
+        """
+        if isinstance(tracks, pd.DataFrame):
+            tracks = zip(tracks['artist'], tracks['song'])
+
+        if limiter is None:
+            limiter = rate_limiter(rate=20)
+
+        results = fetch_as_completed(func=lambda track: self.find_song_id(song_name=track[1], band_name=track[0]),
+                                     items=tracks,
+                                     workers=workers,
+                                     limiter=limiter)
+
+        for (artist, song), sp_id in results:
+            yield artist, song, sp_id
+
+    def iter_songs_features(self, ids: pd.Series or list, workers: int = 4, limiter: rate_limiter = None):
+        """
+        Description:
+            Requests the song features in chunks of 100 ids (the api limit), concurrently,
+                and yields the results of each chunk as soon as it is completed
+
+        Arguments:
+            ids(pd.Series, list):
+                The spotify song ids
+
+            workers(int) = 4:
+                Number of concurrent requests
+
+            limiter(rate_limiter) = None:
+                Optional rate limiter shared by the workers
+
+        Returns:
+            Generator of (chunk ids, list of feature records) tuples
+            Tracks without features come back as None on the records list
+        """
+        ids = list(ids)
+        chunks = [ids[i:i + 100] for i in range(0, len(ids), 100)]
+
+        def request(chunk):
+            r = get_request(url='https://api.spotify.com/v1/audio-features?ids=' + ','.join(chunk),
+                            auth=self.token)
+            return r.json()['audio_features']
+
+        for chunk, records in fetch_as_completed(func=request, items=chunks, workers=workers, limiter=limiter):
+            yield chunk, records
+
+    def get_songs_features(self, ids: pd.Series, progress: progress_reporter = None, workers: int = 4,
+                           limiter: rate_limiter = None) -> pd.DataFrame:
         """
         Description:
             API request to get Spotify's song features from the Spotify track id
+            Chunks are requested concurrently and their records are written on preallocated typed columns
+                (float32 for the audio features), so the dataframe is built only once at the end
 
         Argument:
             ids(pd.series): 
-                A pandas.series of spotify_ids on csv format
+                A pandas.series of spotify_ids
+
+            progress(progress_reporter) = None:
+                If passed, it is updated with the number of ids requested after each request
+
+            workers(int) = 4:
+                Number of concurrent requests
+
+            limiter(rate_limiter) = None:
+                Optional rate limiter shared by the workers
 
         Returns:
-            string with a json file with all the song features for the ids
+            pd.DataFrame with all the song features for the ids. Tracks without features are left out
         """
+        size = len(ids)
+        columns = {feature: np.empty(size, dtype=dtype)
+                   for feature, dtype in FEATURES_DTYPES.items()}
+        columns['id'] = np.empty(size, dtype=object)
+
+        row = 0
+        for chunk, records in self.iter_songs_features(ids=ids, workers=workers, limiter=limiter):
+            for record in records:
+                # Tracks without features come back as null
+                if record is None:
+                    continue
+                for feature, values in columns.items():
+                    values[row] = record[feature]
+                row += 1
+
+            if progress is not None:
+                progress.update(len(chunk))
+
         song_features = pd.DataFrame(
-            columns=['danceability',
-                     'energy',
-                     'key',
-                     'loudness',
-                     'mode',
-                     'speechiness',
-                     'acousticness',
-                     'instrumentalness',
-                     'liveness',
-                     'valence',
-                     'tempo',
-                     'type',
-                     'id',
-                     'uri',
-                     'track_href',
-                     'analysis_url',
-                     'duration_ms',
-                     'time_signature', ])
-
-        splits = ceil(len(ids)/100)
-        chunks = np.array_split(ids, splits)
-
-        for i in range(len(chunks)):
-            # transform the IDs from each chunk into a csv list (string format) to be used at the api request
-            song_ids = chunks[i].to_string(
-                header=False, index=False).replace('\n ', ',').lstrip()
-            # make the api request
-            r = get_request(url='https://api.spotify.com/v1/audio-features?ids=' +
-                            song_ids, headers=self.headers).json()
-
-            # normalize and append the results to a final dataframe
-            temp = pd.json_normalize(r['audio_features'])
-            song_features = song_features.append(temp)
-
-        return song_features
+            {feature: values[:row] for feature, values in columns.items()})
+
+        # The url columns can be derived from the id
+        song_features['type'] = 'audio_features'
+        song_features['uri'] = 'spotify:track:' + song_features['id']
+        song_features['track_href'] = 'https://api.spotify.com/v1/tracks/' + \
+            song_features['id']
+        song_features['analysis_url'] = 'https://api.spotify.com/v1/audio-analysis/' + \
+            song_features['id']
+
+        return song_features[FEATURES_COLUMNS]
 
 
 class spotify_user_api(object):
@@ -239,26 +501,55 @@ class spotify_user_api(object):
             It defined to what we will have access to
             More than one scope can be used separated by simple space ("scope1 scope2 scope3")
 
-        access_token: 
-            The token generated after authentication, to be used on the API
+        token: 
+            The access token generated after authentication (bearer_token), to be used on the API
+            It is refreshed automatically with the refresh token when it expires
+
+        refresh_token:
+            Token used to get new access tokens without a new browser authentication
+            It is stored on the credentials cache, so the following runs can skip the browser
 
         user_id: 
             The Spotify user id. it will be used to generate the api endpoints
 
         headers: 
-            Header with the access token, to be used on all requests made on the user api
+            Header to be used on all requests made on the user api (the access token is added by the token itself)
+
+        credentials:
+            On-disk credentials cache (./cache/spotify_credentials.json) with the user refresh token
+
+        limiter:
+            Optional rate limiter shared by all the playlist requests, so several playlists can be written concurrently
     """
 
-    def __init__(self, client_id: str, client_secret: str, redirect_uri: str, scope: str) -> object:
+    def __init__(self, client_id: str, client_secret: str, redirect_uri: str, scope: str,
+                 credentials: credential_cache = None, limiter: rate_limiter = None) -> object:
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
         self.scope = scope
-        # run the browser authentication and return the authorization code only
-        authorization_code = self.authenticate_user()
-        print("User authentication successful \n")
-        self.access_token = self.get_access_token(
-            authorization_code=authorization_code)
+        self.limiter = limiter
+        self.credentials = credentials if credentials is not None else credential_cache(
+            filename='spotify_credentials')
+        self.token = bearer_token(fetch=self.refresh_access_token)
+        self.refresh_token = self.load_refresh_token()
+
+        if self.refresh_token is not None:
+            try:
+                self.token.get()
+                print("User authenticated with the cached credentials \n")
+            except Exception as e:
+                # Revoked or invalid refresh token: authenticate again on the browser
+                print(f"Cached credentials not valid anymore ({e})")
+                self.credentials.remove(self.client_id)
+                self.refresh_token = None
+
+        if self.refresh_token is None:
+            # run the browser authentication and return the authorization code only
+            authorization_code = self.authenticate_user()
+            print("User authentication successful \n")
+            self.get_access_token(authorization_code=authorization_code)
+
         self.headers = self.get_headers()
         self.user_id = self.get_user_id()
 
@@ -308,6 +599,7 @@ class spotify_user_api(object):
         Description:
             The access token to be used on the api
             After user authentication return an authorization code, we need to make a new request to refresh token
+            The refresh token is stored on the credentials cache
 
         Arguments:
             authorization_code(string): 
@@ -320,20 +612,79 @@ class spotify_user_api(object):
         Returns: 
             string with the access_token
         """
-        auth_pass = f'{self.client_id}:{self.client_secret}'
-        b64_auth_pass = base64.b64encode(auth_pass.encode('utf-8')).decode()
-        r = post_request(
-            url='https://accounts.spotify.com/api/token',
-            headers={'Authorization': f'Basic {b64_auth_pass}'},
+        r = token_request(
+            headers=self.get_basic_auth_headers(),
             data={
                 'grant_type': 'authorization_code',
                 'code': authorization_code,
                 'redirect_uri': self.redirect_uri, })
 
-        return r.json()['access_token']
+        token = r.json()
+        self.token.set(token)
+        self.save_refresh_token(token['refresh_token'])
+
+        return token['access_token']
+
+    def refresh_access_token(self) -> dict:
+        """
+        Description:
+            Request a new access token using the refresh token (no browser needed)
+            If Spotify returns a new refresh token, the cached one is replaced
+
+        Returns:
+            dict with the token endpoint json (access_token, expires_in)
+        """
+        r = token_request(
+            headers=self.get_basic_auth_headers(),
+            data={
+                'grant_type': 'refresh_token',
+                'refresh_token': self.refresh_token, })
+
+        token = r.json()
+        if token.get('refresh_token') not in [None, self.refresh_token]:
+            self.save_refresh_token(token['refresh_token'])
+
+        return token
+
+    def get_basic_auth_headers(self) -> dict:
+        auth_pass = f'{self.client_id}:{self.client_secret}'
+        b64_auth_pass = base64.b64encode(auth_pass.encode('utf-8')).decode()
+        return {'Authorization': f'Basic {b64_auth_pass}'}
+
+    def load_refresh_token(self) -> str:
+        """
+        Description:
+            Load the refresh token from the credentials cache
+            It is only used if it was granted for all the requested scopes
+
+        Returns:
+            string with the refresh token. None if there is no valid cached token
+        """
+        cached = self.credentials.get(self.client_id)
+        if cached is None:
+            return None
+        if not set(self.scope.split()).issubset(cached.get('scope', '').split()):
+            return None
+        return cached.get('refresh_token')
+
+    def save_refresh_token(self, refresh_token: str) -> None:
+        self.refresh_token = refresh_token
+        self.credentials.set(self.client_id, {'refresh_token': refresh_token,
+                                              'scope': self.scope})
+
+    @property
+    def access_token(self) -> str:
+        return self.token.get()
 
     def get_headers(self):
-        return {"Content-Type": "application/json", "Authorization": f"Bearer {self.access_token}"}
+        return {"Content-Type": "application/json"}
+
+    def wait(self) -> None:
+        """
+        Blocks until the shared rate limiter (if any) allows the next playlist request
+        """
+        if self.limiter is not None:
+            self.limiter.wait()
 
     def get_user_id(self) -> str:
         """
@@ -347,7 +698,8 @@ class spotify_user_api(object):
         #                headers={'Authorization': f'Bearer {self.access_token}'})
 
         r = get_request(url='https://api.spotify.com/v1/me',
-                        headers=self.headers)
+                        headers=self.headers,
+                        auth=self.token)
 
         return r.json()['id']
 
@@ -392,9 +744,11 @@ class spotify_user_api(object):
             "collaborative": collaborative
         })
 
+        self.wait()
         r = post_request(url=f'https://api.spotify.com/v1/users/{self.user_id}/playlists',
                          data=request_body,
-                         headers=self.headers)
+                         headers=self.headers,
+                         auth=self.token)
         return r.json()['id']
 
     def add_song_to_playlist(self, songs: str or list, playlist: str) -> None:
@@ -412,7 +766,7 @@ class spotify_user_api(object):
                 The playlist id where the songs should be added
 
         Returns: 
-            None
+            string with the playlist snapshot id after the songs were added
         """
 
         if type(songs) == str:
@@ -430,19 +784,58 @@ class spotify_user_api(object):
                 if "spotify:track:" not in song_id else song_id for song_id in songs]
         data = json.dumps({'uris': data})
 
+        self.wait()
         r = post_request(url=f'https://api.spotify.com/v1/playlists/{playlist}/tracks',
                          data=data,
-                         headers=self.headers)
+                         headers=self.headers,
+                         auth=self.token)
+        return r.json().get('snapshot_id')
+
+    def iter_playlist_songs(self, playlist: str, chunks: bool = False):
+        """
+        Description:
+            Get the song uris of a specified playlist lazily, one page (up to 100 songs) at a time
+            Only the song uris and the link to the next page are requested, and each page is parsed once
+            Mind that different scopes might be needed, depending on the playlist to be either public or private
+
+        Arguments:
+            playlist(string):
+                The playlist id
+
+            chunks(bool) = False:
+                If True, it will yield a list per page, each one with no more than 100 song uris (following the api limits)
+
+        Returns:
+            Generator of song uris (uri format: "spotify:track:{song_id}"), or of lists of song uris if chunks
+            Items without a track (e.g. removed or local songs) are skipped
+        """
+
+        url = f'https://api.spotify.com/v1/playlists/{playlist}/tracks?fields=items(track(uri)),next&limit=100'
+        while url is not None:
+            self.wait()
+            r = get_request(url=url,
+                            headers=self.headers,
+                            auth=self.token)
+            page = r.json()
+            uris = page_uris(page)
+
+            if chunks == True:
+                if uris:
+                    yield uris
+            else:
+                yield from uris
+
+            url = page.get('next')
 
     def get_playlist_songs(self, playlist: str, chunks: bool = False) -> list:
         """
         Description:
-            Get all song uris from a specified playlist.
+            Get all song uris from a specified playlist (see iter_playlist_songs to get them lazily)
             Mind that different scopes might be needed, depending on the playlist to be either public or private
 
         Arguments:
             playlist(string): 
-                The playlist id where the songs should be added
+                The playlist id
 
             chunks(bool) = False: 
                 If True, it will return a list of lists, each element with no more than 100 song ids (following the api limits)
@@ -452,44 +845,7 @@ class spotify_user_api(object):
             It will return an empty list if there are no songs on the playlist
         """
 
-        r = get_request(url=f'https://api.spotify.com/v1/playlists/{playlist}/tracks?fields=total',
-                        headers=self.headers)
-
-        try:
-            total_songs = r.json()['total']
-        except Exception:
-            return []  # The response does not total if the playlist if empty
-
-        # first request
-        r = get_request(url=f'https://api.spotify.com/v1/playlists/{playlist}/tracks?fields=items(track(uri))',
-                            headers=self.headers)
-
-        if chunks == True:
-            song_uris = []
-            temp_list = [r.json()['items'][i]['track']['uri']
-                         for i in range(len(r.json()['items']))]
-            song_uris.append(temp_list)
-        else:
-            song_uris = [r.json()['items'][i]['track']['uri']
-                         for i in range(len(r.json()['items']))]
-
-        # iterate through the following requests
-        offset = 100  # maximum of 100 song ids per request
-        while offset < total_songs:
-            r = get_request(url=f'https://api.spotify.com/v1/playlists/{playlist}/tracks?offset={offset}&fields=items(track(uri))',
-                            headers=self.headers)
-
-            temp_list = [r.json()['items'][i]['track']['uri']
-                         for i in range(len(r.json()['items']))]
-
-            if chunks == True:
-                song_uris.append(temp_list)
-            else:
-                song_uris = song_uris + temp_list
-
-            offset += 100
-
-        return song_uris
+        return list(self.iter_playlist_songs(playlist=playlist, chunks=chunks))
 
     def delete_playlist_songs(self, playlist: str, songs: list or str or bool):
         """
@@ -504,32 +860,156 @@ class spotify_user_api(object):
                 All the songs to be deleted from the playlist in a csv string or list format
                 If True is passed, all songs from the playlist will be deleted
                 It can receive either song ids or song uris or both of them at the same time
-                Up to 100 songs at a time can be removed from the playlist at once (not applied to delete all songs)
+                Songs are removed 100 at a time (a flat list or a csv string is broken in chunks of 100)
                     It will accept a list of lists (each element with no more than 100 songs)
 
         Returns:
-            None
+            string with the playlist snapshot id after the last removal (None if nothing was removed)
         """
 
-        if songs == True:
+        if songs is True:
+            # All pages are read before deleting anything, since each delete would shift the pages offsets
             songs = self.get_playlist_songs(playlist=playlist, chunks=True)
         elif type(songs) == str:
-            songs = songs.split(',')
+            songs = batches(songs.split(','))
         elif type(songs) == list:
-            pass
+            # A flat list of songs is broken in list elements of 100 songs
+            if songs and all(type(song) == str for song in songs):
+                songs = batches(songs)
         else:
             raise TypeError(
                 f"Wrong dataype input for songs. Use either string or list. {type(songs)} was passed")
 
+        snapshot_id = None
         for i in range(len(songs)):
             assert len(
-                songs) <= 100, "No more than 100 song uris at a time can be passed within a single list element"
+                songs[i]) <= 100, "No more than 100 song uris at a time can be passed within a single list element"
 
             data = ["spotify:track:" + song_id
                     if "spotify:track:" not in song_id else song_id for song_id in songs[i]]
             data = [{"uri": uri} for uri in data]
             data = json.dumps({"tracks": data})
 
-            delete_request(url=f'https://api.spotify.com/v1/playlists/{playlist}/tracks',
-                           data=data,
-                           headers=self.headers)
+            self.wait()
+            r = delete_request(url=f'https://api.spotify.com/v1/playlists/{playlist}/tracks',
+                               data=data,
+                               headers=self.headers,
+                               auth=self.token)
+            snapshot_id = r.json().get('snapshot_id')
+        return snapshot_id
+
+    def replace_playlist_songs(self, songs: list, playlist: str) -> str:
+        """
+        Description:
+            Replace all the songs of a playlist with a single request (plus one add request per extra 100 songs)
+            The replace endpoint accepts up to 100 songs, the remaining ones are added after it
+
+        Arguments:
+            songs(list):
+                All the songs the playlist should have, either song ids or song uris. If empty, the playlist is cleared
+
+            playlist(string):
+                The playlist id
+
+        Returns:
+            string with the playlist snapshot id after the last request
+        """
+
+        chunks = batches(song_uris(songs))
+        self.wait()
+        r = put_request(url=f'https://api.spotify.com/v1/playlists/{playlist}/tracks',
+                        data=json.dumps({'uris': chunks[0] if chunks else []}),
+                        headers=self.headers,
+                        auth=self.token)
+        snapshot_id = r.json().get('snapshot_id')
+        for chunk in chunks[1:]:
+            snapshot_id = self.add_song_to_playlist(songs=chunk, playlist=playlist)
+        return snapshot_id
+
+    def get_playlist_snapshot(self, playlist: str) -> str:
+        """
+        Description:
+            Get the current snapshot id of a playlist (a single lightweight request, only the snapshot_id field is requested)
+            The snapshot id changes on every change of the playlist songs
+
+        Arguments:
+            playlist(string):
+                The playlist id
+
+        Returns:
+            string with the playlist snapshot id
+        """
+
+        self.wait()
+        r = get_request(url=f'https://api.spotify.com/v1/playlists/{playlist}?fields=snapshot_id',
+                        headers=self.headers,
+                        auth=self.token)
+        return r.json().get('snapshot_id')
+
+    def sync_playlist(self, playlist: str, songs: list, current: list = None, replace_ratio: float = 0.5) -> dict:
+        """
+        Description:
+            Make a playlist have exactly the songs passed, with the least write requests possible
+            The current songs are compared with the desired ones and only the missing songs are added
+                and the songs not desired anymore are removed (100 songs per request)
+            When most of the playlist changes (more than replace_ratio of the songs), or when it takes less requests,
+                the songs are replaced at once with the replace endpoint instead
+
+        Arguments:
+            playlist(string):
+                The playlist id
+
+            songs(list):
+                All the songs the playlist should have, either song ids or song uris
+
+            current(list) = None:
+                Song uris currently on the playlist. If None, they are requested with get_playlist_songs
+
+            replace_ratio(float) = 0.5:
+                Share of changed songs from which the playlist is replaced instead of synced by differences
+
+        Returns:
+            dict with the sync mode ('unchanged', 'diff' or 'replace'), the number of songs added and removed,
+                the write requests made, the write requests a full rewrite (delete all and add all) would make,
+                the playlist snapshot id after the writes (None if nothing was written) and the playlist songs
+        """
+
+        desired = list(dict.fromkeys(song_uris(songs)))
+        if current is None:
+            current = self.get_playlist_songs(playlist=playlist)
+        current_set = set(current)
+        desired_set = set(desired)
+
+        # Songs are removed by uri, so a repeated song can only be kept through a replace
+        to_remove = [uri for uri in dict.fromkeys(current) if uri not in desired_set]
+        to_add = [uri for uri in desired if uri not in current_set]
+        repeated = len(current) != len(current_set)
+
+        full_rewrite_calls = len(batches(current)) + len(batches(desired))
+        diff_calls = len(batches(to_remove)) + len(batches(to_add))
+        replace_calls = max(len(batches(desired)), 1)
+        changed = max(len(to_add), len(to_remove)) / max(len(desired), len(current), 1)
+
+        snapshot_id = None
+        if not (to_add or to_remove or repeated):
+            mode, calls = 'unchanged', 0
+        elif repeated or changed > replace_ratio or replace_calls < diff_calls:
+            mode, calls = 'replace', replace_calls
+            snapshot_id = self.replace_playlist_songs(songs=desired, playlist=playlist)
+        else:
+            mode, calls = 'diff', diff_calls
+            if to_remove:
+                snapshot_id = self.delete_playlist_songs(playlist=playlist, songs=batches(to_remove))
+            for chunk in batches(to_add):
+                snapshot_id = self.add_song_to_playlist(songs=chunk, playlist=playlist)
+            # Removed songs leave the playlist and the added ones go to its end
+            desired = [uri for uri in current if uri in desired_set] + to_add
+
+        return {'playlist': playlist,
+                'mode': mode,
+                'added': len(to_add),
+                'removed': len(to_remove),
+                'calls': calls,
+                'full_rewrite_calls': full_rewrite_calls,
+                'snapshot_id': snapshot_id,
+                'songs': desired if mode != 'unchanged' else list(current)}
@@ -0,0 +1,254 @@
+import os
+import sqlite3
+import pathlib
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+# Expected columns and data types for each dataset
+# Audio features are stored as float32 (the api returns no more than 6 significant digits)
+# Columns not listed here are kept as they are, so new columns can be added to a dataset without a schema change
+SCHEMAS = {
+    'lastfm_played_tracks': {
+        'artist': 'object',
+        'song': 'object',
+        'unix_timestamp': 'int64',
+        'nowplaying': 'bool',
+    },
+    'spotify_tracks_ids': {
+        'artist': 'object',
+        'song': 'object',
+        'sp_id': 'object',
+        'no_id': 'bool',
+    },
+    'spotify_songs_features': {
+        'danceability': 'float32',
+        'energy': 'float32',
+        'key': 'int8',
+        'loudness': 'float32',
+        'mode': 'int8',
+        'speechiness': 'float32',
+        'acousticness': 'float32',
+        'instrumentalness': 'float32',
+        'liveness': 'float32',
+        'valence': 'float32',
+        'tempo': 'float32',
+        'type': 'object',
+        'id': 'object',
+        'uri': 'object',
+        'track_href': 'object',
+        'analysis_url': 'object',
+        'duration_ms': 'int64',
+        'time_signature': 'int8',
+    },
+    'clusterization': {
+        'artist': 'object',
+        'song': 'object',
+        'energy': 'float32',
+        'loudness': 'float32',
+        'acousticness': 'float32',
+        'instrumentalness': 'float32',
+        'valence': 'float32',
+        'tempo': 'float32',
+        'id': 'object',
+        'duration_ms': 'int64',
+        'time_signature': 'int8',
+        'play_count': 'int64',
+        'last_played': 'int64',
+        'cluster': 'object',
+    },
+    'playlists': {
+        'playlist_id': 'object',
+        'snapshot_id': 'object',
+        'tracks': 'object',
+    },
+    'clusterization_k_scores': {
+        'k': 'int64',
+        'inertia': 'float64',
+        'silhouette': 'float64',
+        'elbow_score': 'float64',
+        'silhouette_score': 'float64',
+        'score': 'float64',
+        'chosen': 'bool',
+    },
+}
+
+# Song features returned by the api and the data types they are stored with
+FEATURES_DTYPES = {
+    'danceability': np.float32,
+    'energy': np.float32,
+    'key': np.int8,
+    'loudness': np.float32,
+    'mode': np.int8,
+    'speechiness': np.float32,
+    'acousticness': np.float32,
+    'instrumentalness': np.float32,
+    'liveness': np.float32,
+    'valence': np.float32,
+    'tempo': np.float32,
+    'duration_ms': np.int64,
+    'time_signature': np.int8,
+}
+
+
+def apply_schema(filename: str, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Description:
+        Cast the dataframe columns to the data types defined for the dataset.
+        Columns that can not be casted (e.g. integers with missing values) are kept as they are
+
+    Arguments:
+        filename(string):
+            Name of the dataset
+
+        df(pd.DataFrame):
+            The data to be casted
+
+    Returns:
+        pd.DataFrame with the casted columns
+    """
+    schema = SCHEMAS.get(filename, {})
+    for column, dtype in schema.items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        try:
+            df[column] = df[column].astype(dtype)
+        except (ValueError, TypeError):
+            pass
+    return df
+
+
+class file_backend(object):
+    """
+    Description:
+        Storage backend with one file per dataset
+
+    Arguments:
+        name:
+            The backend name, as used on the STORAGE_BACKEND config
+
+        extension:
+            Extension of the stored files
+    """
+
+    def __init__(self, name: str, extension: str) -> object:
+        self.name = name
+        self.extension = extension
+
+    def __str__(self):
+        return f"{self.name} storage backend"
+
+    def path(self, filename: str, filepath: str) -> pathlib.Path:
+        return pathlib.Path(filepath) / f'{filename}.{self.extension}'
+
+    def exists(self, filename: str, filepath: str) -> bool:
+        return self.path(filename, filepath).is_file()
+
+    def save(self, filename: str, df: pd.DataFrame, filepath: str) -> None:
+        path = self.path(filename, filepath)
+        df = df.reset_index(drop=True)
+        if self.name == 'csv':
+            df.to_csv(path, index=False)
+        elif self.name == 'parquet':
+            df.to_parquet(path, index=False)
+        elif self.name == 'feather':
+            df.to_feather(path)
+
+    def upsert(self, filename: str, df: pd.DataFrame, key: list, filepath: str) -> None:
+        # Single file datasets can only be rewritten: stored rows with the same key are replaced
+        if self.exists(filename, filepath):
+            stored = apply_schema(filename, self.load(filename, filepath))
+            df = pd.concat([stored, df], ignore_index=True)
+        self.save(filename, df.drop_duplicates(subset=key, keep='last'), filepath)
+
+    def load(self, filename: str, filepath: str, columns: list = None) -> pd.DataFrame:
+        path = self.path(filename, filepath)
+        if self.name == 'csv':
+            return pd.read_csv(path, usecols=columns)
+        elif self.name == 'parquet':
+            return pd.read_parquet(path, columns=columns)
+        elif self.name == 'feather':
+            return pd.read_feather(path, columns=columns)
+
+
+class sqlite_backend(object):
+    """
+    Description:
+        Storage backend with one sqlite database per data folder and one table per dataset
+    """
+
+    name = 'sqlite'
+    database = 'data.sqlite'
+
+    def __str__(self):
+        return f"{self.name} storage backend"
+
+    @contextmanager
+    def connect(self, filepath: str):
+        con = sqlite3.connect(pathlib.Path(filepath) / self.database)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def exists(self, filename: str, filepath: str) -> bool:
+        if not (pathlib.Path(filepath) / self.database).is_file():
+            return False
+        with self.connect(filepath) as con:
+            r = con.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                            (filename,)).fetchone()
+        return r is not None
+
+    def save(self, filename: str, df: pd.DataFrame, filepath: str) -> None:
+        with self.connect(filepath) as con:
+            df.to_sql(filename, con, if_exists='replace', index=False)
+
+    def upsert(self, filename: str, df: pd.DataFrame, key: list, filepath: str) -> None:
+        # Only the rows with the new keys are touched: stored rows with the same key are deleted and the new ones appended
+        df = df.drop_duplicates(subset=key, keep='last')
+        if not self.exists(filename, filepath):
+            return self.save(filename, df, filepath)
+
+        columns = ', '.join(f'"{c}"' for c in key)
+        with self.connect(filepath) as con:
+            df[key].to_sql('upsert_keys', con, if_exists='replace', index=False)
+            con.execute(f'DELETE FROM "{filename}" WHERE ({columns}) IN (SELECT {columns} FROM upsert_keys)')
+            con.execute('DROP TABLE upsert_keys')
+            df.to_sql(filename, con, if_exists='append', index=False)
+
+    def load(self, filename: str, filepath: str, columns: list = None) -> pd.DataFrame:
+        select = '*' if columns is None else ', '.join(f'"{c}"' for c in columns)
+        with self.connect(filepath) as con:
+            return pd.read_sql_query(f'SELECT {select} FROM "{filename}"', con)
+
+
+BACKENDS = {
+    'csv': file_backend(name='csv', extension='csv'),
+    'parquet': file_backend(name='parquet', extension='parquet'),
+    'feather': file_backend(name='feather', extension='feather'),
+    'sqlite': sqlite_backend(),
+}
+
+
+def get_backend(name: str = None):
+    """
+    Description:
+        Storage backend to be used. If no name is passed, it is read from the STORAGE_BACKEND env variable (default is csv)
+
+    Arguments:
+        name(string) = None:
+            One of csv, parquet, feather or sqlite
+
+    Returns:
+        The storage backend object
+    """
+    if name is None:
+        name = os.environ.get('STORAGE_BACKEND', 'csv')
+    try:
+        return BACKENDS[name.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unknown storage backend {name}. Use one of {', '.join(BACKENDS)}")
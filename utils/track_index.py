@@ -0,0 +1,339 @@
+import time
+import sqlite3
+import pathlib
+import unicodedata
+from contextlib import contextmanager
+
+import pandas as pd
+
+from utils.matching import normalize_artist, normalize_title
+
+
+# Seconds a not_found search result is trusted before the track is searched again (30 days)
+NOT_FOUND_TTL = 30 * 24 * 3600
+
+
+def normalize_key(value: str) -> str:
+    """
+    Description:
+        Normalized form of an artist or song name, used as the index key
+        Unicode compatibility characters are folded, case is ignored and whitespaces are collapsed
+
+    Arguments:
+        value(string):
+            The artist or song name
+
+    Returns:
+        string with the normalized name
+    """
+    return ' '.join(unicodedata.normalize('NFKC', str(value)).casefold().split())
+
+
+class track_index(object):
+    """
+    Description:
+        Persistent index of the spotify track ids, shared in between all users
+        Tracks are stored on a sqlite table with a unique key on the normalized (artist, song),
+            so checking which tracks still need an id and storing the new ones costs only as much as the new tracks
+        Every search result is also stored as an alias of its matching key (see utils.matching), so other spellings
+            of a known song ("Song - Remastered", "The Band") are resolved locally, without an api call
+        not_found results are only trusted for not_found_ttl seconds, then the track is searched again
+        Ids whose features came back empty are kept as well, so their features are only requested again
+            after not_found_ttl seconds
+
+    Arguments:
+        filepath:
+            Folder where the index database is stored
+
+        filename:
+            Name of the database file (without the extension)
+
+        not_found_ttl:
+            Seconds a not_found result (or an id without features) is kept before the track is searched again
+    """
+
+    def __init__(self, filepath: str = './data', filename: str = 'spotify_tracks_ids',
+                 not_found_ttl: int = NOT_FOUND_TTL) -> object:
+        self.filepath = filepath
+        self.not_found_ttl = not_found_ttl
+        pathlib.Path(filepath).mkdir(parents=True, exist_ok=True)
+        self.path = pathlib.Path(filepath) / f'{filename}.sqlite'
+        new = not self.path.is_file()
+        self.create_table()
+        if new:
+            self.import_stored(filename=filename)
+
+    def __str__(self):
+        return f"Spotify track ids index at {self.path}"
+
+    def __len__(self):
+        with self.connect() as con:
+            return con.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+    @contextmanager
+    def connect(self):
+        con = sqlite3.connect(self.path)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def create_table(self) -> None:
+        with self.connect() as con:
+            con.execute('''
+                CREATE TABLE IF NOT EXISTS tracks (
+                    artist_key TEXT NOT NULL,
+                    song_key TEXT NOT NULL,
+                    artist TEXT,
+                    song TEXT,
+                    sp_id TEXT,
+                    no_id INTEGER,
+                    checked_at INTEGER,
+                    PRIMARY KEY (artist_key, song_key)
+                ) WITHOUT ROWID''')
+            con.execute('''
+                CREATE TABLE IF NOT EXISTS aliases (
+                    artist_key TEXT NOT NULL,
+                    song_key TEXT NOT NULL,
+                    sp_id TEXT,
+                    no_id INTEGER,
+                    checked_at INTEGER,
+                    PRIMARY KEY (artist_key, song_key)
+                ) WITHOUT ROWID''')
+            con.execute('''
+                CREATE TABLE IF NOT EXISTS no_features (
+                    sp_id TEXT PRIMARY KEY,
+                    checked_at INTEGER
+                ) WITHOUT ROWID''')
+
+    def import_stored(self, filename: str) -> None:
+        """
+        Description:
+            One-shot import of the track ids stored as a dataset (the previous storage of the ids)
+            The configured storage backend is read first, then the other ones, since the dataset may have been
+                stored (or migrated) with another backend
+        """
+        # Imported here to avoid a circular import with utils.utils
+        from utils.utils import load_results
+        from utils.storage import BACKENDS, get_backend
+
+        configured = get_backend().name
+        stored = None
+        for backend in [configured] + [name for name in BACKENDS if name != configured]:
+            stored = load_results(filename=filename, filepath=self.filepath, backend=backend)
+            if stored is not None:
+                break
+        if stored is not None and len(stored) > 0:
+            print(f"Importing {len(stored)} stored track ids into {self.path}")
+            self.upsert(stored)
+
+    @staticmethod
+    def keys(tracks: pd.DataFrame) -> list:
+        return [(normalize_key(artist), normalize_key(song), artist, song)
+                for artist, song in zip(tracks['artist'], tracks['song'])]
+
+    @staticmethod
+    def match_keys(tracks: pd.DataFrame) -> list:
+        return [(normalize_artist(artist), normalize_title(song))
+                for artist, song in zip(tracks['artist'], tracks['song'])]
+
+    @contextmanager
+    def lookup_table(self, tracks: pd.DataFrame, keys=None):
+        """
+        Description:
+            Temporary table with the keys of the tracks to be looked up, so the lookup is a single indexed join
+            keys is the function that builds the keys (the index keys by default)
+        """
+        keys = self.keys if keys is None else keys
+        with self.connect() as con:
+            con.execute('''
+                CREATE TEMP TABLE lookup (
+                    position INTEGER PRIMARY KEY,
+                    artist_key TEXT,
+                    song_key TEXT)''')
+            con.executemany('INSERT INTO lookup VALUES (?, ?, ?)',
+                            [(i, key[0], key[1]) for i, key in enumerate(keys(tracks))])
+            yield con
+
+    def expired_at(self) -> int:
+        """
+        Returns:
+            int with the unix timestamp before which not_found results are expired
+        """
+        return int(time.time()) - self.not_found_ttl
+
+    def missing(self, tracks: pd.DataFrame) -> pd.DataFrame:
+        """
+        Description:
+            Bulk lookup of the tracks that are not on the index yet, or whose not_found result is expired
+
+        Arguments:
+            tracks(pd.DataFrame):
+                Dataframe with artist and song columns
+
+        Returns:
+            pd.DataFrame with the rows of tracks that need a search
+        """
+        tracks = tracks.reset_index(drop=True)
+        if len(tracks) == 0:
+            return tracks
+
+        with self.lookup_table(tracks) as con:
+            positions = [r[0] for r in con.execute('''
+                SELECT lookup.position
+                FROM lookup
+                LEFT JOIN tracks
+                    ON tracks.artist_key = lookup.artist_key AND tracks.song_key = lookup.song_key
+                WHERE tracks.artist_key IS NULL
+                    OR (tracks.no_id = 1 AND tracks.checked_at < ?)''', (self.expired_at(),))]
+
+        return tracks.iloc[positions].reset_index(drop=True)
+
+    def lookup(self, tracks: pd.DataFrame) -> pd.DataFrame:
+        """
+        Description:
+            Bulk lookup of the spotify ids of the tracks
+
+        Arguments:
+            tracks(pd.DataFrame):
+                Dataframe with artist and song columns
+
+        Returns:
+            pd.DataFrame with the artist and song of the indexed tracks (as passed on tracks), sp_id and no_id
+        """
+        tracks = tracks[['artist', 'song']].reset_index(drop=True)
+        if len(tracks) == 0:
+            return tracks.assign(sp_id=pd.Series(dtype=object), no_id=pd.Series(dtype=bool))
+
+        with self.lookup_table(tracks) as con:
+            found = pd.DataFrame(data=con.execute('''
+                SELECT lookup.position, tracks.sp_id, tracks.no_id
+                FROM lookup
+                JOIN tracks
+                    ON tracks.artist_key = lookup.artist_key AND tracks.song_key = lookup.song_key''').fetchall(),
+                columns=['position', 'sp_id', 'no_id'])
+
+        found = found.set_index('position')
+        df = tracks.iloc[found.index].copy()
+        df['sp_id'] = found['sp_id'].values
+        df['no_id'] = found['no_id'].astype(bool).values
+        return df.reset_index(drop=True)
+
+    def resolve_aliases(self, tracks: pd.DataFrame) -> tuple:
+        """
+        Description:
+            Resolve the tracks whose matching key is a known alias (a spelling variant of a searched song)
+            not_found aliases are only used while they are not expired
+
+        Arguments:
+            tracks(pd.DataFrame):
+                Dataframe with artist and song columns
+
+        Returns:
+            tuple with a pd.DataFrame of the resolved tracks (artist, song, sp_id and no_id columns)
+                and a pd.DataFrame with the rows of tracks that still need a search
+        """
+        tracks = tracks[['artist', 'song']].reset_index(drop=True)
+        if len(tracks) == 0:
+            return tracks.assign(sp_id=pd.Series(dtype=object), no_id=pd.Series(dtype=bool)), tracks
+
+        with self.lookup_table(tracks, keys=self.match_keys) as con:
+            found = pd.DataFrame(data=con.execute('''
+                SELECT lookup.position, aliases.sp_id, aliases.no_id
+                FROM lookup
+                JOIN aliases
+                    ON aliases.artist_key = lookup.artist_key AND aliases.song_key = lookup.song_key
+                WHERE aliases.no_id = 0 OR aliases.checked_at >= ?''', (self.expired_at(),)).fetchall(),
+                columns=['position', 'sp_id', 'no_id'])
+
+        found = found.set_index('position')
+        resolved = tracks.iloc[found.index].copy()
+        resolved['sp_id'] = found['sp_id'].values
+        resolved['no_id'] = found['no_id'].astype(bool).values
+
+        remaining = tracks.drop(index=found.index)
+        return resolved.reset_index(drop=True), remaining.reset_index(drop=True)
+
+    def upsert(self, tracks: pd.DataFrame) -> None:
+        """
+        Description:
+            Bulk insert or update of track ids, and of the aliases of their matching keys
+            A found id is never replaced by a not_found result of another spelling
+
+        Arguments:
+            tracks(pd.DataFrame):
+                Dataframe with artist, song, sp_id and no_id columns
+
+        Returns:
+            None
+        """
+        now = int(time.time())
+        rows = [key + (sp_id, int(no_id), now)
+                for key, sp_id, no_id in zip(self.keys(tracks), tracks['sp_id'], tracks['no_id'])]
+        aliases = [key + (sp_id, int(no_id), now)
+                   for key, sp_id, no_id in zip(self.match_keys(tracks), tracks['sp_id'], tracks['no_id'])]
+
+        with self.connect() as con:
+            con.executemany('''
+                INSERT INTO tracks (artist_key, song_key, artist, song, sp_id, no_id, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (artist_key, song_key) DO UPDATE SET
+                    sp_id = excluded.sp_id,
+                    no_id = excluded.no_id,
+                    checked_at = excluded.checked_at''', rows)
+            con.executemany('''
+                INSERT INTO aliases (artist_key, song_key, sp_id, no_id, checked_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (artist_key, song_key) DO UPDATE SET
+                    sp_id = excluded.sp_id,
+                    no_id = excluded.no_id,
+                    checked_at = excluded.checked_at
+                WHERE excluded.no_id = 0 OR aliases.no_id = 1''', aliases)
+
+    def load(self) -> pd.DataFrame:
+        """
+        Description:
+            Load the whole index
+
+        Returns:
+            pd.DataFrame with artist, song, sp_id and no_id columns
+        """
+        with self.connect() as con:
+            df = pd.read_sql_query(
+                'SELECT artist, song, sp_id, no_id FROM tracks', con)
+        df['no_id'] = df['no_id'].astype(bool)
+        return df
+
+    def without_features(self, ids: pd.Series) -> pd.Series:
+        """
+        Description:
+            Check which ids had no features on their last request, while that result is not expired
+
+        Arguments:
+            ids(pd.Series):
+                The spotify song ids
+
+        Returns:
+            pd.Series of bool, aligned with ids, True for the ids known to have no features
+        """
+        with self.connect() as con:
+            known = [r[0] for r in con.execute('SELECT sp_id FROM no_features WHERE checked_at >= ?',
+                                               (self.expired_at(),))]
+        return pd.Series(ids).isin(known)
+
+    def upsert_without_features(self, ids: list) -> None:
+        """
+        Description:
+            Store the ids whose features request came back empty, with the time they were checked
+
+        Arguments:
+            ids(list):
+                The spotify song ids without features
+        """
+        now = int(time.time())
+        with self.connect() as con:
+            con.executemany('''
+                INSERT INTO no_features (sp_id, checked_at) VALUES (?, ?)
+                ON CONFLICT (sp_id) DO UPDATE SET checked_at = excluded.checked_at''',
+                            [(sp_id, now) for sp_id in ids])
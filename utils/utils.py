@@ -1,8 +1,18 @@
+import os
 import sys
+import pickle
 import pathlib
 import pandas as pd
 #import requests_cache
 
+from utils.storage import get_backend, apply_schema
+from utils.scrobble_store import list_partitions, upsert_scrobbles, load_scrobbles
+
+# Datasets stored on month partitions instead of a single file
+PARTITIONED = ['lastfm_played_tracks']
+# Datasets replaced by another storage, only read once to be imported (the spotify ids are on the sqlite track index)
+RETIRED = ['spotify_tracks_ids']
+
 
 # def initiate_cache(filename: str, relative_path='./cache') -> None:
 #    """
@@ -47,46 +57,56 @@ import pandas as pd
 #        pass
 
 
-def save_results(filename: str, df: pd.DataFrame, filepath='./data') -> None:
+def save_results(filename: str, df: pd.DataFrame, filepath='./data', backend: str = None) -> None:
     """
     Saves the results for th api request. If the folder does not exist, creates it first
     Mind that the file will be saved without the index
 
     Arguments:
-        filename (string): name of the csv file to be saved (without the extension)
+        filename (string): name of the dataset to be saved (without the extension)
 
-        df (dataframe): dataframe to be saved as a csv file
+        df (dataframe): dataframe to be saved
 
         filepath (string): relative path where the results should be stored 
             If the relative path stated does not exist, it will create the folder.
 
+        backend (string): storage backend (csv, parquet, feather or sqlite).
+            If not declared, the STORAGE_BACKEND env variable is used (default is csv)
+
     Returns None
     """
 
     if not pathlib.Path(filepath).is_dir():
-        pathlib.Path(filepath).mkdir()
+        pathlib.Path(filepath).mkdir(parents=True)
 
-    savepath = filepath + '/' + filename + '.csv'
-    df.to_csv(savepath, index=False)
+    df = apply_schema(filename=filename, df=df)
+    get_backend(backend).save(filename=filename, df=df, filepath=filepath)
 
 
-def load_results(filename: str, filepath: str = './data') -> pd.DataFrame:
+def load_results(filename: str, filepath: str = './data', columns: list = None, backend: str = None) -> pd.DataFrame:
     """
-    Load csv files.
+    Load stored datasets.
 
     Arguments:
-        filename (string): name of the csv file to be loaded (without the extension)
+        filename (string): name of the dataset to be loaded (without the extension)
 
-        filepath (string): relative path to the folder where the csv file is stored
+        filepath (string): relative path to the folder where the dataset is stored
+
+        columns (list): if declared, only these columns are loaded
+
+        backend (string): storage backend (csv, parquet, feather or sqlite).
+            If not declared, the STORAGE_BACKEND env variable is used (default is csv)
 
     Returns:
-        A Pandas dataframe of the loaded csv file. If the file doesn't exist, returns None
+        A Pandas dataframe of the loaded dataset. If the dataset doesn't exist, returns None
     """
 
-    loadpath = filepath + '/' + filename + '.csv'
-    if pathlib.Path(loadpath).is_file():
+    storage = get_backend(backend)
+    if storage.exists(filename=filename, filepath=filepath):
         try:
-            return pd.read_csv(loadpath)
+            df = storage.load(filename=filename,
+                              filepath=filepath, columns=columns)
+            return apply_schema(filename=filename, df=df)
         except Exception as e:
             print(e)
             sys.exit()
@@ -94,26 +114,163 @@ def load_results(filename: str, filepath: str = './data') -> pd.DataFrame:
         return None
 
 
-def load_user_results(filename: str, user: str, filepath: str = './data') -> pd.DataFrame:
+def upsert_results(filename: str, df: pd.DataFrame, key: list, filepath='./data', backend: str = None) -> None:
+    """
+    Insert or update rows of a stored dataset. Stored rows with the same key as the new ones are replaced
+    If the dataset doesn't exist, it is created
+
+    Arguments:
+        filename (string): name of the dataset (without the extension)
+
+        df (dataframe): the new rows
+
+        key (list): columns that identify a row (e.g. ['id'])
+
+        filepath (string): relative path where the results should be stored
+
+        backend (string): storage backend (csv, parquet, feather or sqlite).
+            If not declared, the STORAGE_BACKEND env variable is used (default is csv)
+
+    Returns None
+    """
+
+    if not pathlib.Path(filepath).is_dir():
+        pathlib.Path(filepath).mkdir(parents=True)
+
+    storage = get_backend(backend)
+    if len(df) == 0 and storage.exists(filename=filename, filepath=filepath):
+        return
+
+    df = apply_schema(filename=filename, df=df)
+    storage.upsert(filename=filename, df=df, key=key, filepath=filepath)
+
+
+def load_user_results(filename: str, user: str, filepath: str = './data', columns: list = None,
+                      start: int = None, end: int = None) -> pd.DataFrame:
     """
     Load personal user information.
 
     Arguments:
-        filename (string): name of the csv file to be loaded (without the extension)
+        filename (string): name of the dataset to be loaded (without the extension)
 
         user (string): username in which the data is stored
 
-        filepath (string): relative path to the folder where the csv file is stored
+        filepath (string): relative path to the data folder
+
+        columns (list): if declared, only these columns are loaded
+
+        start (int): for partitioned data (lastfm_played_tracks), only rows from this unix timestamp on are loaded
+
+        end (int): for partitioned data (lastfm_played_tracks), only rows up to this unix timestamp are loaded
 
     Returns:
-        A Pandas dataframe of the loaded csv file. If the file doesn't exists, returns None
+        A Pandas dataframe of the loaded dataset. If the dataset doesn't exists, returns None
     """
 
+    if filename in PARTITIONED:
+        partitions_path = user_partitions_path(
+            filename=filename, user=user, filepath=filepath)
+
+        df = load_scrobbles(filepath=partitions_path,
+                            start=start, end=end, columns=columns)
+        if df is None:
+            print(
+                f"WARNING: No personal {filename} data found for {user}")
+        return df
+
     filepath = filepath + '/users/' + user
 
-    if pathlib.Path(filepath + '/' + filename + '.csv').is_file():
-        return load_results(filename=filename, filepath=filepath)
-    else:
+    df = load_results(filename=filename, filepath=filepath, columns=columns)
+    if df is None:
         print(
             f"WARNING: No personal {filename} data found for {user}")
+    return df
+
+
+def user_partitions_path(filename: str, user: str, filepath: str = './data') -> str:
+    """
+    Path to the folder with the month partitions of a user dataset.
+    If only a legacy csv file is found, it is converted into partitions first
+
+    Arguments:
+        filename (string): name of the partitioned dataset
+
+        user (string): username in which the data is stored
+
+        filepath (string): relative path to the data folder
+
+    Returns:
+        string with the partitions folder path
+    """
+
+    user_path = filepath + '/users/' + user
+    partitions_path = user_path + '/' + filename
+
+    if not list_partitions(partitions_path) and pathlib.Path(partitions_path + '.csv').is_file():
+        migrate_to_partitions(filename=filename, filepath=user_path)
+
+    return partitions_path
+
+
+def migrate_to_partitions(filename: str, filepath: str) -> None:
+    """
+    One-shot conversion of a legacy csv file into month partitions.
+    The csv file is kept with a .migrated suffix instead of being deleted
+
+    Arguments:
+        filename (string): name of the csv file to be converted (without the extension)
+
+        filepath (string): relative path to the folder where the csv file is stored
+
+    Returns None
+    """
+
+    print(f"Converting {filepath}/{filename}.csv into month partitions")
+    df = load_results(filename=filename, filepath=filepath, backend='csv')
+    upsert_scrobbles(df=df, filepath=filepath + '/' + filename)
+
+    csv_path = pathlib.Path(filepath + '/' + filename + '.csv')
+    csv_path.rename(csv_path.with_suffix('.csv.migrated'))
+
+
+def save_model(filename: str, model, filepath: str = './data') -> None:
+    """
+    Saves a python object (e.g. a fitted model and its scaler) on a pickle file. If the folder does not exist, creates it first
+    The file is replaced atomically, so an interrupted run never leaves a broken model behind
+
+    Arguments:
+        filename (string): name of the file to be saved (without the extension)
+
+        model (object): the object to be saved
+
+        filepath (string): relative path where the file should be stored
+
+    Returns None
+    """
+
+    pathlib.Path(filepath).mkdir(parents=True, exist_ok=True)
+    path = pathlib.Path(filepath) / f'{filename}.pkl'
+    temp_path = path.with_suffix('.tmp')
+    with open(temp_path, 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def load_model(filename: str, filepath: str = './data'):
+    """
+    Loads a python object saved with save_model
+
+    Arguments:
+        filename (string): name of the file to be loaded (without the extension)
+
+        filepath (string): relative path to the folder where the file is stored
+
+    Returns:
+        The loaded object. If the file doesn't exists, returns None
+    """
+
+    path = pathlib.Path(filepath) / f'{filename}.pkl'
+    if not path.is_file():
         return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)